@@ -52,9 +52,16 @@ class Arena():
                 assert self.display
                 print("Turn ", str(it), "Player ", str(curPlayer))
                 self.display(board)
-            action = players[curPlayer + 1](self.game.getCanonicalForm(board, curPlayer))
+            canonicalBoard = self.game.getCanonicalForm(board, curPlayer)
 
-            valids = self.game.getValidMoves(self.game.getCanonicalForm(board, curPlayer), 1)
+            # Letting search-based players move their tree root to the new position
+            for player in players[0], players[2]:
+                if hasattr(player, "advanceRoot"):
+                    player.advanceRoot(canonicalBoard)
+
+            action = players[curPlayer + 1](canonicalBoard)
+
+            valids = self.game.getValidMoves(canonicalBoard, 1)
 
             if valids[action] == 0:
                 log.error(f'Action {action} is not valid!')
@@ -87,6 +94,8 @@ class Arena():
             oneWon: games won by player1
             twoWon: games won by player2
             draws:  games won by nobody
+
+        Players with search stats (see MCTSPlayer) get them logged at the end.
         """
 
         num = int(num / 2)
@@ -113,4 +122,9 @@ class Arena():
             else:
                 draws += 1
 
+        # the players are still swapped
+        for name, player in ('player1', self.player2), ('player2', self.player1):
+            if getattr(player, 'stats', None) is not None:
+                log.info(f'{name} search: {player.stats}')
+
         return oneWon, twoWon, draws
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+
+import numpy as np
+
+from MCTS import MCTS
+
+log = logging.getLogger(__name__)
+
+
+class BatchEvaluator():
+    """
+    Evaluates boards for any number of coroutines on one asyncio event loop
+    with batched calls of nnet.predict_batch. Boards are queued by evaluate
+    and flushed together once maxBatchSize of them are waiting, or timeoutMs
+    after the first one was queued, whichever comes first.
+
+    The forward pass itself runs on the event loop, so the network is only
+    ever used from one thread.
+    """
+
+    def __init__(self, nnet, maxBatchSize=32, timeoutMs=1):
+        self.nnet = nnet
+        self.maxBatchSize = maxBatchSize
+        self.timeoutMs = timeoutMs
+        self.queue = []  # (board, future) waiting for the next flush
+        self.timer = None
+        self.numBatches = 0
+        self.numBoards = 0
+
+    async def evaluate(self, board):
+        """
+        Returns:
+            pi, v: the prediction of the network for board
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.queue.append((board, future))
+        if len(self.queue) >= self.maxBatchSize:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.timeoutMs / 1000., self.flush)
+        return await future
+
+    def flush(self):
+        """
+        Evaluates every queued board in one batch and resolves their futures.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        queue, self.queue = self.queue, []
+        if not queue:
+            return
+        self.numBatches += 1
+        self.numBoards += len(queue)
+        try:
+            pis, vs = self.nnet.predict_batch([board for board, _ in queue])
+        except Exception as e:
+            for _, future in queue:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), pi, v in zip(queue, pis, vs):
+            if not future.done():
+                future.set_result((pi, v))
+
+    def meanBatchSize(self):
+        return self.numBoards / self.numBatches if self.numBatches else 0.
+
+
+class AsyncMCTS(MCTS):
+    """
+    An MCTS whose search and getActionProb are coroutines: leaves are
+    evaluated by awaiting a BatchEvaluator instead of calling nnet.predict,
+    so the searches of many games (or many requests of a server) can run
+    concurrently on one event loop and share batched forward passes.
+
+    Each call of getActionProb keeps args.leafBatchSize (default 1)
+    simulations of its own in flight, separated by virtual loss as in
+    MCTS.searchBatch. The tree is only touched between awaits, so no lock is
+    needed even when several getActionProb calls share it (as long as the
+    tree is not budgeted: an eviction by one call could free the path
+    another one is waiting on). Gumbel root search and args.earlyStop's stop
+    on a decided move are not supported; forced moves are still played
+    without searching.
+    """
+
+    def __init__(self, game, evaluator, args):
+        if args.get('gumbel', False):
+            raise ValueError('AsyncMCTS does not support args.gumbel')
+        super().__init__(game, evaluator.nnet, args)
+        self.evaluator = evaluator
+
+    async def getActionProb(self, canonicalBoard, temp=1, numSims=None):
+        """
+        The coroutine version of MCTS.getActionProb.
+        """
+        if self.args.get('earlyStop', False):
+            probs = self.forcedMove(canonicalBoard, numSims)
+            if probs is not None:
+                return probs
+
+        perm = None
+        if self.symmetricTree:
+            canonicalBoard, perm = self.symmetricForm(canonicalBoard)
+
+        s = self.boardKey(canonicalBoard)
+        self.lastSearchSims = await self.runSimulations(canonicalBoard, numSims=numSims)
+
+        if self.budgeted:
+            self.evict(keep=s)
+        counts = np.zeros(self.game.getActionSize(), dtype=np.int64)
+        if self.Ss.get(s) == 1:
+            counts[self.winningAction(s)] = 1
+        elif s in self.Nsa:
+            counts[self.As[s]] = self.Nsa[s]
+        if not counts.any() and s in self.Ps:
+            counts = np.zeros(len(counts))
+            counts[self.As[s]] = self.Ps[s]
+        if perm is not None:
+            counts = counts[np.argsort(perm)]
+        return self.countsToProbs(counts, temp)
+
+    async def runSimulations(self, canonicalBoard, numSims=None):
+        """
+        The coroutine version of MCTS.runSimulations: runs rounds of
+        args.leafBatchSize concurrent simulations until the budget is spent.
+
+        Returns:
+            numSims: the number of simulations run
+        """
+        budget = self.searchBudget(numSims)
+        leafBatchSize = self.args.get('leafBatchSize', 1)
+        root = self.boardKey(canonicalBoard)
+        numSims = 0
+        while not self.budgetSpent(root, numSims, budget):
+            numLeaves = leafBatchSize if root in self.Ps else 1
+            if budget.maxSims is not None:
+                numLeaves = min(numLeaves, max(budget.maxSims, budget.minSims) - numSims)
+            await asyncio.gather(*[self.search(canonicalBoard) for _ in range(numLeaves)])
+            numSims += numLeaves
+        return numSims
+
+    async def search(self, canonicalBoard):
+        """
+        The coroutine version of MCTS.search. With virtual loss on its path
+        while the leaf is being evaluated; a leaf that another simulation
+        expanded in the meantime is not expanded again.
+
+        Returns:
+            v: the negative of the value of the current canonicalBoard
+        """
+        virtualLoss = self.args.get('virtualLoss', 1)
+        path, board, s, v = self.selectLeaf(canonicalBoard, virtualLoss)
+
+        if v is None:
+            # leaf node
+            pi, v = await self.evaluator.evaluate(board)
+            if s not in self.Ps:
+                self.expand(s, board, pi)
+
+        return -self.backup(path, v, virtualLoss)
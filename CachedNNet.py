@@ -0,0 +1,119 @@
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+from NeuralNet import NeuralNet
+from utils import *
+
+ENTRY_OVERHEAD = 200  # approximate bytes of the OrderedDict entry and result tuple per board
+
+
+class CachedNNet(NeuralNet):
+    """
+    Wraps any NeuralNet with a bounded LRU cache of its predictions, keyed by
+    game.stringRepresentation (game.hashKey with hashKeys). A single CachedNNet can be shared
+    by all the MCTS instances of a process, so positions met again in other
+    episodes, arena games or pit games are not evaluated twice.
+
+    The cache is invalidated whenever the weights change through train or
+    load_checkpoint. It is not pickled: copies sent to worker processes start
+    empty.
+    """
+
+    def __init__(self, nnet, game, maxSize=100000, hashKeys=False):
+        self.nnet = nnet
+        self.boardKey = game.hashKey if hashKeys and hasattr(game, 'hashKey') else game.stringRepresentation
+        self.maxSize = maxSize
+        self.cache = OrderedDict()  # board key -> (pi, v), least recently used first
+        self.cacheBytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def train(self, examples):
+        self.nnet.train(examples)
+        self.invalidate()
+
+    def predict(self, board):
+        key = self.boardKey(board)
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        self.misses += 1
+        result = self.nnet.predict(board)
+        self.store(key, result)
+        return result
+
+    def predict_batch(self, boards):
+        results = [None] * len(boards)
+        missing = []
+        for i, board in enumerate(boards):
+            key = self.boardKey(board)
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                results[i] = self.cache[key]
+            else:
+                missing.append((i, key))
+        self.hits += len(boards) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            pis, vs = self.nnet.predict_batch([boards[i] for i, _ in missing])
+            for (i, key), pi, v in zip(missing, pis, vs):
+                results[i] = (pi, v)
+                self.store(key, results[i])
+
+        pis = np.array([pi for pi, _ in results])
+        vs = np.array([v for _, v in results], dtype=np.float64).reshape(len(boards))
+        return pis, vs
+
+    def store(self, key, result):
+        if key in self.cache:
+            return
+        self.cache[key] = result
+        self.cacheBytes += self.entryBytes(key, result)
+        while len(self.cache) > self.maxSize:
+            oldKey, oldResult = self.cache.popitem(last=False)
+            self.cacheBytes -= self.entryBytes(oldKey, oldResult)
+
+    @staticmethod
+    def entryBytes(key, result):
+        pi, v = result
+        return sys.getsizeof(key) + np.asarray(pi).nbytes + np.asarray(v).nbytes + ENTRY_OVERHEAD
+
+    def invalidate(self):
+        """
+        Drops every cached prediction, e.g. after the weights have changed.
+        """
+        self.cache.clear()
+        self.cacheBytes = 0
+
+    def stats(self):
+        """
+        Returns:
+            stats: hits, misses, hitRate, entries and (estimated) bytes of
+                   the cache
+        """
+        lookups = self.hits + self.misses
+        return dotdict({
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / lookups if lookups else 0.,
+            'entries': len(self.cache),
+            'bytes': self.cacheBytes,
+        })
+
+    def save_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
+        self.nnet.save_checkpoint(folder=folder, filename=filename)
+
+    def load_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
+        self.nnet.load_checkpoint(folder=folder, filename=filename)
+        self.invalidate()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['cache'] = OrderedDict()
+        state['cacheBytes'] = 0
+        return state
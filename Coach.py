@@ -1,17 +1,25 @@
+import json
 import logging
+import multiprocessing as mp
 import os
+import queue
 import sys
+import time
 from collections import deque
 from pickle import Pickler, Unpickler
 from random import shuffle
-from multiprocessing import Pool, cpu_count
+from multiprocessing import cpu_count
 
 
 import numpy as np
 from tqdm import tqdm
 
 from Arena import Arena
-from MCTS import MCTS
+from CachedNNet import CachedNNet
+from MCTS import MCTS, MCTSPlayer, SearchStats
+from Pipeline import BEST_FILE, arenaLoop, getBestFile, selfPlayLoop
+from ReplayBuffer import ReplayBuffer
+from SelfPlay import AsyncSelfPlay, LockstepSelfPlay, SelfPlayWorkers, executeEpisode
 
 log = logging.getLogger(__name__)
 
@@ -25,13 +33,25 @@ class Coach:
     def __init__(self, game, nnet, args):
         self.game = game
         self.nnet = nnet
-        self.pnet = self.nnet.__class__(self.game)  # the competitor network
+        self.nnetClass = self.nnet.__class__
+        self.pnet = self.nnetClass(self.game)  # the competitor network
         self.args = args
+        if self.args.get('nnetCacheSize'):
+            # LRU caches of predictions shared by every MCTS using these networks
+            hashKeys = self.args.get('hashKeys', False)
+            self.nnet = CachedNNet(self.nnet, self.game, self.args.nnetCacheSize, hashKeys)
+            self.pnet = CachedNNet(self.pnet, self.game, self.args.nnetCacheSize, hashKeys)
         self.mcts = MCTS(self.game, self.nnet, self.args)
         self.trainExamplesHistory = (
             []
         )  # history of examples from args.numItersForTrainExamplesHistory latest iterations
+        self.replayBuffer = None  # replaces trainExamplesHistory with args.replayBuffer
+        if self.args.get('replayBuffer', False):
+            self.replayBuffer = self.newReplayBuffer()
+        self.shards = []  # manifest entries of the replay buffer iterations saved to disk, oldest first
+        self.unsavedIterations = 0  # newest replay buffer iterations without shards yet
         self.skipFirstSelfPlay = False  # can be overriden in loadTrainExamples()
+        self.gateResults = []  # the arena outcomes of learnAsync, see logGateResult
 
     def executeEpisode(self):
         """
@@ -42,47 +62,35 @@ class Coach:
         in trainExamples.
 
         It uses a temp=1 if episodeStep < tempThreshold, and thereafter
-        uses temp=0.
+        uses temp=0. With args.gumbel the improved policy of the search is
+        always the training target, and the move played is the winner of the
+        sequential halving (see SelfPlay.chooseAction).
+
+        With args.playoutCapFraction (playout cap randomization), only that
+        fraction of the moves, picked at random, gets the full numMCTSSims
+        search and is recorded as a training example; the other moves are
+        played after a fast search of numMCTSSimsFast simulations. Every
+        game still provides value targets for its recorded moves.
 
         Returns:
             trainExamples: a list of examples of the form (canonicalBoard, currPlayer, pi,v)
                            pi is the MCTS informed policy vector, v is +1 if
                            the player eventually won the game, else -1.
         """
-        trainExamples = []
-        board = self.game.getInitBoard()
-        self.curPlayer = 1
-        episodeStep = 0
-
-        while True:
-            episodeStep += 1
-            canonicalBoard = self.game.getCanonicalForm(board, self.curPlayer)
-            temp = int(episodeStep < self.args.tempThreshold)
-
-            pi = self.mcts.getActionProb(canonicalBoard, temp=temp)
-            sym = self.game.getSymmetries(canonicalBoard, pi)
-            for b, p in sym:
-                trainExamples.append([b, self.curPlayer, p, None])
-
-            action = np.random.choice(len(pi), p=pi)
-            board, self.curPlayer = self.game.getNextState(
-                board, self.curPlayer, action
-            )
-
-            r = self.game.getGameEnded(board, self.curPlayer)
-
-            if r != 0:
-                return [
-                    (x[0], x[2], r * ((-1) ** (x[1] != self.curPlayer)))
-                    for x in trainExamples
-                ]
+        return executeEpisode(self.game, self.mcts, self.args)
 
     def _executeEpisodeWrapper(self, _):
         """
         Wrapper function to call executeEpisode for multiprocessing.
+
+        Returns:
+            trainExamples: the examples of executeEpisode
+            stats: the SearchStats of the episode (with args.collectStats)
         """
         self.mcts = MCTS(self.game, self.nnet, self.args)  # reset search tree
-        return self.executeEpisode()
+        stats = SearchStats()
+        self.mcts.onStats = stats.merge
+        return self.executeEpisode(), stats
 
     def learn(self):
         """
@@ -91,7 +99,17 @@ class Coach:
         examples in trainExamples (which has a maximum length of maxlenofQueue).
         It then pits the new neural network against the old one and accepts it
         only if it wins >= updateThreshold fraction of games.
+
+        The self-play processes (SelfPlayWorkers) are started once and only
+        reload the weights when a new network has been accepted. With
+        args.asyncSelfPlay (AsyncSelfPlay) or args.lockstepGames
+        (LockstepSelfPlay) the games are played in this process instead,
+        several at a time, with their leaves evaluated in shared batches.
         """
+        workers = None
+        if not self.args.get('asyncSelfPlay', False) and not self.args.get('lockstepGames'):
+            workers = SelfPlayWorkers(self.game, self.nnetClass, self.args, max(1, cpu_count() // 2))
+            workers.publish(self.nnet)
 
         for i in range(1, self.args.numIters + 1):
             # bookkeeping
@@ -100,27 +118,35 @@ class Coach:
             if not self.skipFirstSelfPlay or i > 1:
                 iterationTrainExamples = deque([], maxlen=self.args.maxlenOfQueue)
 
-                # Use multiprocessing to execute episodes in parallel
-                with Pool(processes=cpu_count() // 2) as pool:
-                    results = []
-                    for result in tqdm(
-                        pool.imap_unordered(
-                            self._executeEpisodeWrapper, range(self.args.numEps)
-                        ),
-                        total=self.args.numEps,
-                        desc="Self Play",
-                    ):
-                        results.append(result)
+                if self.args.get('asyncSelfPlay', False):
+                    # play the episodes as coroutines sharing one batching evaluator
+                    selfPlay = AsyncSelfPlay(self.game, self.nnet, self.args)
+                    results = [(examples, None) for examples in selfPlay.playGames(self.args.numEps)]
+                elif self.args.get('lockstepGames'):
+                    # play the episodes in lockstep, batching their leaves across games
+                    selfPlay = LockstepSelfPlay(self.game, self.nnet, self.args)
+                    results = [(examples, None) for examples in tqdm(selfPlay.playGames(self.args.numEps),
+                                                                     total=self.args.numEps, desc="Self Play")]
+                else:
+                    # Use the worker processes to execute episodes in parallel
+                    results = list(tqdm(workers.playGames(self.args.numEps),
+                                        total=self.args.numEps, desc="Self Play"))
 
                 # Combine results from all processes
-                for result in results:
-                    iterationTrainExamples += result
+                selfPlayStats = SearchStats()
+                for examples, stats in results:
+                    iterationTrainExamples += examples
+                    if stats is not None:
+                        selfPlayStats.merge(stats)
+                if self.args.get('collectStats', False):
+                    log.info(f"SELF PLAY SEARCH : {selfPlayStats}")
 
                 # save the iteration examples to the history
-                self.trainExamplesHistory.append(iterationTrainExamples)
+                self.addIterationExamples(iterationTrainExamples)
 
             if (
-                len(self.trainExamplesHistory)
+                self.replayBuffer is None
+                and len(self.trainExamplesHistory)
                 > self.args.numItersForTrainExamplesHistory
             ):
                 log.warning(
@@ -132,10 +158,7 @@ class Coach:
             self.saveTrainExamples(i - 1)
 
             # shuffle examples before training
-            trainExamples = []
-            for e in self.trainExamplesHistory:
-                trainExamples.extend(e)
-            shuffle(trainExamples)
+            trainExamples = self.getTrainExamples()
 
             # training new network, keeping a copy of the old one
             self.nnet.save_checkpoint(
@@ -150,14 +173,16 @@ class Coach:
             nmcts = MCTS(self.game, self.nnet, self.args)
 
             log.info("PITTING AGAINST PREVIOUS VERSION")
-            arena = Arena(
-                lambda x: np.argmax(pmcts.getActionProb(x, temp=0)),
-                lambda x: np.argmax(nmcts.getActionProb(x, temp=0)),
-                self.game,
-            )
+            pplayer, nplayer = MCTSPlayer(pmcts), MCTSPlayer(nmcts)
+            arena = Arena(pplayer, nplayer, self.game)
             pwins, nwins, draws = arena.playGames(self.args.arenaCompare)
 
             log.info("NEW/PREV WINS : %d / %d ; DRAWS : %d" % (nwins, pwins, draws))
+            if self.args.get('earlyStop', False):
+                simsSaved = pplayer.simsSavedPerGame + nplayer.simsSavedPerGame
+                log.info(f"MCTS SIMS SAVED PER GAME : {np.mean(simsSaved):.0f}")
+            if isinstance(self.nnet, CachedNNet):
+                log.info(f"NNET CACHE : {self.nnet.stats()} ; PNET CACHE : {self.pnet.stats()}")
             if (
                 pwins + nwins == 0
                 or float(nwins) / (pwins + nwins) < self.args.updateThreshold
@@ -174,6 +199,145 @@ class Coach:
                 self.nnet.save_checkpoint(
                     folder=self.args.checkpoint, filename="best.pth.tar"
                 )
+                if workers is not None:
+                    workers.publish(self.nnet)
+
+        if workers is not None:
+            workers.close()
+
+    def learnAsync(self):
+        """
+        A pipelined version of learn, without barriers between the stages:
+            - args.selfPlayProcesses (default cpu_count() // 2) processes play
+              self-play games with the best network all the time and stream
+              the finished games to this process,
+            - this process trains the network each time numEps new games
+              have arrived (numIters times) and publishes the result as a
+              candidate checkpoint,
+            - a gating process pits the newest candidate against the best
+              network and promotes it if it wins >= updateThreshold
+              fraction of the games (the last candidate is always gated);
+              the self-play processes then switch to it before their next
+              game.
+        Unlike learn, the trained network is not rolled back when a
+        candidate is rejected: training just goes on. The throughput of
+        every stage is logged after every training round, and the arena
+        outcomes are kept in gateResults. Raises RuntimeError if the gating
+        process or a self-play process fails.
+        """
+        ctx = mp.get_context()
+        bestVersion = ctx.Value('i', 1)
+        games, candidates, results = ctx.Queue(), ctx.Queue(), ctx.Queue()
+        self.nnet.save_checkpoint(folder=self.args.checkpoint, filename=getBestFile(1))
+        self.nnet.save_checkpoint(folder=self.args.checkpoint, filename=BEST_FILE)
+
+        numProcesses = self.args.get('selfPlayProcesses', max(1, cpu_count() // 2))
+        selfPlayers = [ctx.Process(target=selfPlayLoop, daemon=True,
+                                   args=(self.game, self.nnetClass, self.args, bestVersion, games, seed))
+                       for seed in np.random.randint(2 ** 31, size=numProcesses)]
+        gate = ctx.Process(target=arenaLoop, daemon=True,
+                           args=(self.game, self.nnetClass, self.args, candidates, results, bestVersion))
+        for process in selfPlayers + [gate]:
+            process.start()
+
+        roundStart = time.time()
+        for i in range(1, self.args.numIters + 1):
+            iterationTrainExamples = deque([], maxlen=self.args.maxlenOfQueue)
+            selfPlayStats = SearchStats()
+            for _ in tqdm(range(self.args.numEps), desc="Self Play"):
+                examples, stats = self.nextGame(games, selfPlayers, gate)
+                iterationTrainExamples += examples
+                selfPlayStats.merge(stats)
+            elapsed = time.time() - roundStart
+            log.info(f"SELF PLAY : {self.args.numEps / elapsed:.2f} games/s, "
+                     f"{len(iterationTrainExamples) / elapsed:.1f} examples/s, best version {bestVersion.value}")
+            if self.args.get('collectStats', False):
+                log.info(f"SELF PLAY SEARCH : {selfPlayStats}")
+
+            self.addIterationExamples(iterationTrainExamples)
+            if self.replayBuffer is None and len(self.trainExamplesHistory) > self.args.numItersForTrainExamplesHistory:
+                self.trainExamplesHistory.pop(0)
+            self.saveTrainExamples(i - 1)
+
+            trainExamples = self.getTrainExamples()
+            start = time.time()
+            self.nnet.train(trainExamples)
+            log.info(f"TRAIN : {len(trainExamples)} examples in {time.time() - start:.1f}s")
+            self.nnet.save_checkpoint(folder=self.args.checkpoint, filename=self.getCheckpointFile(i))
+            candidates.put(self.getCheckpointFile(i))
+            roundStart = time.time()
+
+            try:
+                while True:
+                    self.logGateResult(*results.get_nowait())
+            except queue.Empty:
+                pass
+            if not gate.is_alive():
+                break
+
+        candidates.put(None)
+        gate.join()
+        # the results are all queued once the gating process has exited
+        try:
+            while True:
+                self.logGateResult(*results.get(timeout=1))
+        except queue.Empty:
+            pass
+        for process in selfPlayers:
+            process.terminate()
+        if gate.exitcode != 0:
+            raise RuntimeError(f"The gating process failed (exit code {gate.exitcode})")
+
+    def nextGame(self, games, selfPlayers, gate):
+        """
+        Waits for the next game of the self-play processes. The processes
+        loop forever, so if one of them has exited, all the processes are
+        terminated and RuntimeError is raised instead of waiting for games
+        that will never come.
+        """
+        while True:
+            try:
+                return games.get(timeout=1)
+            except queue.Empty:
+                pass
+            for process in selfPlayers:
+                if not process.is_alive():
+                    for p in selfPlayers + [gate]:
+                        p.terminate()
+                    raise RuntimeError(f"A self-play process failed (exit code {process.exitcode})")
+
+    def logGateResult(self, candidate, pwins, nwins, draws, accepted, elapsed):
+        self.gateResults.append((candidate, pwins, nwins, draws, accepted))
+        log.info(f"ARENA : {candidate} NEW/PREV WINS : {nwins} / {pwins} ; DRAWS : {draws} ; "
+                 f"{'ACCEPTED' if accepted else 'REJECTED'} ; {self.args.arenaCompare / elapsed:.2f} games/s")
+
+    def newReplayBuffer(self):
+        capacity = self.args.get('replayBufferSize',
+                                 self.args.numItersForTrainExamplesHistory * self.args.maxlenOfQueue)
+        return ReplayBuffer(self.game.getBoardSize(), self.game.getActionSize(),
+                            capacity, self.args.numItersForTrainExamplesHistory)
+
+    def addIterationExamples(self, iterationTrainExamples):
+        if self.replayBuffer is not None:
+            self.replayBuffer.add(iterationTrainExamples)
+            self.unsavedIterations += 1
+        else:
+            self.trainExamplesHistory.append(iterationTrainExamples)
+
+    def getTrainExamples(self):
+        """
+        Returns:
+            trainExamples: the examples of the history in a shuffled list, or
+                           the replay buffer itself, which the networks sample
+                           their batches from
+        """
+        if self.replayBuffer is not None:
+            return self.replayBuffer
+        trainExamples = []
+        for e in self.trainExamplesHistory:
+            trainExamples.extend(e)
+        shuffle(trainExamples)
+        return trainExamples
 
     def getCheckpointFile(self, iteration):
         return "checkpoint_" + str(iteration) + ".pth.tar"
@@ -182,17 +346,73 @@ class Coach:
         folder = self.args.checkpoint
         if not os.path.exists(folder):
             os.makedirs(folder)
+        if self.replayBuffer is not None:
+            self.saveShards(iteration)
+            return
         filename = os.path.join(folder, self.getCheckpointFile(iteration) + ".examples")
         with open(filename, "wb+") as f:
             Pickler(f).dump(self.trainExamplesHistory)
         f.closed
 
+    def saveShards(self, iteration):
+        """
+        Saves the replay buffer incrementally: the iterations added since the
+        last call are written once, as .npy shards of boards, pis and vs, and
+        a small JSON manifest (the .examples.json file of the checkpoint)
+        lists the shards of the iterations still in the buffer. Older shards
+        are left on disk for the manifests that reference them.
+        """
+        folder = self.args.checkpoint
+        prefix = self.getCheckpointFile(iteration) + ".examples"
+        numIterations = len(self.replayBuffer.iterationSizes)
+        for k in range(max(0, numIterations - self.unsavedIterations), numIterations):
+            files = {}
+            for name, array in zip(("boards", "pis", "vs"), self.replayBuffer.iteration(k)):
+                files[name] = f"{prefix}.{k}.{name}.npy"
+                np.save(os.path.join(folder, files[name]), array)
+            self.shards.append({"files": files})
+        self.unsavedIterations = 0
+
+        # the buffer may have dropped old iterations, and overwritten the start of the oldest one
+        self.shards = self.shards[-numIterations:] if numIterations else []
+        for shard, size in zip(self.shards[::-1], list(self.replayBuffer.iterationSizes)[::-1]):
+            shard["size"] = size
+        with open(os.path.join(folder, prefix + ".json"), "w") as f:
+            json.dump({"shards": self.shards}, f, indent=1)
+
+    def loadShards(self, manifestFile):
+        """
+        Fills the replay buffer with the shards listed in a manifest written
+        by saveShards, memory-mapping them so only the examples in the window
+        are read.
+        """
+        folder = os.path.dirname(manifestFile)
+        with open(manifestFile) as f:
+            shards = json.load(f)["shards"]
+        if self.replayBuffer is None:
+            self.replayBuffer = self.newReplayBuffer()
+        shards = shards[-self.replayBuffer.window:]
+        for shard in shards:
+            arrays = [np.load(os.path.join(folder, shard["files"][name]), mmap_mode="r")
+                      for name in ("boards", "pis", "vs")]
+            self.replayBuffer.addArrays(*[array[len(array) - shard["size"]:] for array in arrays])
+            # the next manifests are written to the checkpoint folder
+            shard["files"] = {name: os.path.relpath(os.path.join(folder, file), self.args.checkpoint)
+                              for name, file in shard["files"].items()}
+        self.shards = shards[-len(self.replayBuffer.iterationSizes):]
+        self.unsavedIterations = 0
+
     def loadTrainExamples(self):
         modelFile = os.path.join(
             self.args.load_folder_file[0], self.args.load_folder_file[1]
         )
         examplesFile = modelFile + ".examples"
-        if not os.path.isfile(examplesFile):
+        if os.path.isfile(examplesFile + ".json"):
+            log.info("Manifest of trainExamples shards found. Loading them...")
+            self.loadShards(examplesFile + ".json")
+            log.info("Loading done!")
+            self.skipFirstSelfPlay = True
+        elif not os.path.isfile(examplesFile):
             log.warning(f'File "{examplesFile}" with trainExamples not found!')
             r = input("Continue? [y|n]")
             if r != "y":
@@ -200,7 +420,12 @@ class Coach:
         else:
             log.info("File with trainExamples found. Loading it...")
             with open(examplesFile, "rb") as f:
-                self.trainExamplesHistory = Unpickler(f).load()
+                examples = Unpickler(f).load()
+            if self.replayBuffer is not None:
+                for iterationTrainExamples in examples:
+                    self.addIterationExamples(iterationTrainExamples)
+            else:
+                self.trainExamplesHistory = examples
             log.info("Loading done!")
 
             # examples based on the model were already collected (loaded)
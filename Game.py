@@ -111,3 +111,19 @@ class Game():
                          Required by MCTS for hashing.
         """
         pass
+
+    def hashKey(self, board):
+        """
+        Input:
+            board: current board
+
+        Returns:
+            key: a hashable key identifying board, used by MCTS to index its
+                 tables when args.hashKeys is set. Optional: defaults to
+                 stringRepresentation. Games whose boards are small integer
+                 arrays can return a 64-bit Zobrist hash instead (see
+                 utils.ZobristHash), which is much smaller to store than the
+                 string, though slower to compute (~5 vs ~3 us on Othello
+                 8x8).
+        """
+        return self.stringRepresentation(board)
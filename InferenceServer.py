@@ -0,0 +1,186 @@
+import logging
+import multiprocessing as mp
+import queue
+import time
+
+import numpy as np
+
+from NeuralNet import NeuralNet
+
+log = logging.getLogger(__name__)
+
+
+class InferenceServer():
+    """
+    A process that owns the only copy of the network and evaluates boards for
+    up to numWorkers worker processes, which talk to it through RemoteNNet
+    proxies (see connect).
+
+    Every worker has a slot of args.leafBatchSize (default 1) boards in a
+    shared input array and as many results (pi followed by v) in a shared
+    output array. A worker writes its boards to its slot, puts
+    (workerId, numBoards) on the request queue and waits on its event. The
+    server collects requests until args.inferenceBatchSize (default 64)
+    boards are waiting, every connected worker has made a request, or
+    args.inferenceTimeoutMs (default 2) have passed since the first one. It
+    evaluates them with a single nnet.predict_batch, writes the results to
+    the output slots and sets the events.
+
+    Only games whose boards are numpy arrays of game.getBoardSize() are
+    supported.
+    """
+
+    def __init__(self, game, nnetClass, numWorkers, args):
+        self.numWorkers = numWorkers
+        self.boardShape = tuple(game.getBoardSize())
+        self.actionSize = game.getActionSize()
+        self.maxBoards = args.get('leafBatchSize', 1)
+        self.inputs = mp.RawArray('d', numWorkers * self.maxBoards * int(np.prod(self.boardShape)))
+        self.outputs = mp.RawArray('d', numWorkers * self.maxBoards * (self.actionSize + 1))
+        self.requests = mp.Queue()
+        self.events = [mp.Event() for _ in range(numWorkers)]
+        self.numConnected = mp.Value('i', 0)
+        self.numBatches = mp.Value('i', 0)
+        self.numBoards = mp.Value('i', 0)
+        self.process = mp.Process(target=self.serve, args=(game, nnetClass, args), daemon=True)
+        self.process.start()
+
+    def views(self):
+        """
+        Returns:
+            inputs, outputs: numpy views of the shared arrays, indexed by
+                             worker and board
+        """
+        inputs = np.frombuffer(self.inputs, dtype=np.float64).reshape((self.numWorkers, self.maxBoards) + self.boardShape)
+        outputs = np.frombuffer(self.outputs, dtype=np.float64).reshape(self.numWorkers, self.maxBoards, self.actionSize + 1)
+        return inputs, outputs
+
+    def serve(self, game, nnetClass, args):
+        """
+        The loop of the server process.
+        """
+        nnet = nnetClass(game)
+        batchSize = args.get('inferenceBatchSize', 64)
+        timeout = args.get('inferenceTimeoutMs', 2) / 1000.
+        inputs, outputs = self.views()
+        pending = None  # a control message that ended the collection of a batch
+        while True:
+            message = pending if pending is not None else self.requests.get()
+            pending = None
+            if message == 'stop':
+                break
+            if message[0] == 'load':
+                nnet.load_checkpoint(folder=message[1], filename=message[2])
+                continue
+
+            batch = [message]
+            numBoards = message[1]
+            deadline = time.time() + timeout
+            # a worker waits for its results, so once all of them are in the batch nothing else can come
+            while numBoards < batchSize and len(batch) < self.numConnected.value:
+                try:
+                    message = self.requests.get(timeout=max(0., deadline - time.time()))
+                except queue.Empty:
+                    break
+                if message == 'stop' or message[0] == 'load':
+                    pending = message
+                    break
+                batch.append(message)
+                numBoards += message[1]
+
+            pis, vs = nnet.predict_batch([inputs[w, i] for w, n in batch for i in range(n)])
+            vs = np.reshape(vs, -1)
+            k = 0
+            for w, n in batch:
+                outputs[w, :n, :-1] = pis[k:k + n]
+                outputs[w, :n, -1] = vs[k:k + n]
+                k += n
+                self.events[w].set()
+            self.numBatches.value += 1
+            self.numBoards.value += numBoards
+
+    def connect(self):
+        """
+        Returns:
+            nnet: a RemoteNNet evaluating on this server, to be called in the
+                  worker process (up to numWorkers of them)
+        """
+        with self.numConnected.get_lock():
+            workerId = self.numConnected.value
+            self.numConnected.value += 1
+        if workerId >= self.numWorkers:
+            raise ValueError(f'InferenceServer only has slots for {self.numWorkers} workers')
+        return RemoteNNet(self, workerId)
+
+    def load(self, folder, filename):
+        """
+        Makes the server load the weights of a checkpoint; requests queued
+        after this call are evaluated with them.
+        """
+        self.requests.put(('load', folder, filename))
+
+    def meanBatchSize(self):
+        return self.numBoards.value / self.numBatches.value if self.numBatches.value else 0.
+
+    def close(self):
+        self.requests.put('stop')
+        self.process.join()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['process']
+        return state
+
+
+class RemoteNNet(NeuralNet):
+    """
+    A NeuralNet whose predictions are made by an InferenceServer; obtained
+    with InferenceServer.connect. Training and saving are left to the
+    process owning the real network.
+    """
+
+    def __init__(self, server, workerId):
+        self.server = server
+        self.workerId = workerId
+        self.event = server.events[workerId]
+        inputs, outputs = server.views()
+        self.inputs = inputs[workerId]
+        self.outputs = outputs[workerId]
+
+    def predict(self, board):
+        pis, vs = self.predict_batch([board])
+        return pis[0], vs[0]
+
+    def predict_batch(self, boards):
+        pis = np.empty((len(boards), self.server.actionSize))
+        vs = np.empty(len(boards))
+        for start in range(0, len(boards), self.server.maxBoards):
+            chunk = boards[start:start + self.server.maxBoards]
+            for i, board in enumerate(chunk):
+                self.inputs[i] = board
+            self.event.clear()
+            self.server.requests.put((self.workerId, len(chunk)))
+            self.event.wait()
+            pis[start:start + len(chunk)] = self.outputs[:len(chunk), :-1]
+            vs[start:start + len(chunk)] = self.outputs[:len(chunk), -1]
+        return pis, vs
+
+    def load_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
+        self.server.load(folder, filename)
+
+    def train(self, examples):
+        raise NotImplementedError('RemoteNNet cannot be trained, train the network of the server instead')
+
+    def save_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
+        raise NotImplementedError('RemoteNNet cannot save weights, save the network of the server instead')
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['inputs'], state['outputs']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        inputs, outputs = self.server.views()
+        self.inputs = inputs[self.workerId]
+        self.outputs = outputs[self.workerId]
@@ -1,13 +1,109 @@
+import heapq
 import logging
 import math
+import sys
+import time
 
 import numpy as np
 
+from utils import dotdict
+
 EPS = 1e-8
+NODE_OVERHEAD = 800  # approximate bytes of dict entries and Python objects held per board
+
+GAME_LOGIC = ('getNextState', 'getValidMoves', 'getGameEnded', 'getCanonicalForm', 'getSymmetries')
 
 log = logging.getLogger(__name__)
 
 
+class SearchStats():
+    """
+    Counters of one or more MCTS searches (see args.collectStats): searches,
+    simulations, boards expanded, depth of the descents, descents ending in
+    a terminal board, and the time spent in the network, in the game logic
+    and in total. Stats of several searches are combined with merge.
+    """
+
+    def __init__(self):
+        self.numSearches = 0
+        self.numSims = 0
+        self.nodesCreated = 0
+        self.depthSum = 0  # over all descents, see meanDepth
+        self.maxDepth = 0
+        self.terminalHits = 0
+        self.numDescents = 0
+        self.predictTime = 0.
+        self.gameTime = 0.
+        self.totalTime = 0.
+
+    def merge(self, other):
+        """
+        Adds the counters of other to these ones.
+        """
+        for name, value in vars(other).items():
+            if name == 'maxDepth':
+                self.maxDepth = max(self.maxDepth, value)
+            else:
+                setattr(self, name, getattr(self, name) + value)
+        return self
+
+    def meanDepth(self):
+        return self.depthSum / self.numDescents if self.numDescents else 0.
+
+    def simsPerSecond(self):
+        return self.numSims / self.totalTime if self.totalTime else 0.
+
+    def bookkeepingTime(self):
+        """
+        Returns the time spent neither in the network nor in the game logic,
+        i.e. in the tree itself.
+        """
+        return self.totalTime - self.predictTime - self.gameTime
+
+    def __str__(self):
+        total = self.totalTime or 1.
+        return (f'{self.numSearches} searches, {self.numSims} sims ({self.simsPerSecond():.0f}/s), '
+                f'{self.nodesCreated} nodes, depth {self.meanDepth():.1f} mean / {self.maxDepth} max, '
+                f'{self.terminalHits} terminal hits, time {self.totalTime:.1f}s: '
+                f'nnet {self.predictTime / total:.0%}, game {self.gameTime / total:.0%}, '
+                f'tree {self.bookkeepingTime() / total:.0%}')
+
+
+class TimedCalls():
+    """
+    Stands in for obj (a Game or NeuralNet), adding the time spent in the
+    given methods to the field of the current SearchStats of mcts.
+    """
+
+    def __init__(self, obj, mcts, field, methods):
+        self.__setstate__((obj, mcts, field, methods))
+
+    def __getstate__(self):
+        return self.obj, self.mcts, self.field, self.methods
+
+    def __setstate__(self, state):
+        self.obj, self.mcts, self.field, self.methods = state
+        for name in self.methods:
+            if hasattr(self.obj, name):
+                setattr(self, name, self.timed(getattr(self.obj, name), self.mcts, self.field))
+
+    @staticmethod
+    def timed(method, mcts, field):
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                if mcts.stats is not None:
+                    setattr(mcts.stats, field, getattr(mcts.stats, field) + time.perf_counter() - start)
+        return call
+
+    def __getattr__(self, name):
+        if name == 'obj':
+            raise AttributeError(name)
+        return getattr(self.obj, name)
+
+
 class MCTS():
     """
     This class handles the MCTS tree.
@@ -17,29 +113,212 @@ class MCTS():
         self.game = game
         self.nnet = nnet
         self.args = args
-        self.Qsa = {}  # stores Q values for s,a (as defined in the paper)
-        self.Nsa = {}  # stores #times edge s,a was visited
+        # boards are indexed by stringRepresentation, or with args.hashKeys by game.hashKey (a 64-bit
+        # Zobrist key for most games: far less memory per board, but slower to compute)
+        self.boardKey = game.stringRepresentation
+        if args.get('hashKeys', False) and hasattr(game, 'hashKey'):
+            self.boardKey = game.hashKey
+        # Per-board arrays only cover the valid actions of s: the ith entry of
+        # Ps[s], Nsa[s] and Qsa[s] belongs to action As[s][i].
+        self.As = {}  # stores the valid actions of board s (game.getValidMoves)
+        self.Qsa = {}  # stores Q values of every valid action a from board s (as defined in the paper)
+        self.Nsa = {}  # stores #times each edge s,a was visited
         self.Ns = {}  # stores #times board s was visited
         self.Ps = {}  # stores initial policy (returned by neural net)
 
         self.Es = {}  # stores game.getGameEnded ended for board s
-        self.Vs = {}  # stores game.getValidMoves for board s
+        self.Cs = {}  # stores the board s' reached by every traversed edge s,i
+        self.Ss = {}  # stores 1 (-1) if board s is proven won (lost) for its player (only with mctsSolver)
+        self.Ws = {}  # stores the index i of the action proving board s won
+        self.mctsSolver = args.get('mctsSolver', False)
+
+        # optional progressive widening: only the k(Ns) = ceil(pwConstant * (Ns + 1) ** pwExponent)
+        # actions with the highest prior are eligible at a board visited Ns times
+        self.progressiveWidening = args.get('progressiveWidening', False)
+        self.pwConstant = args.get('pwConstant', 1.0)
+        self.pwExponent = args.get('pwExponent', 0.5)
+
+        # optional memory budget, enforced after every getActionProb call
+        self.maxTreeNodes = args.get('maxTreeNodes')
+        self.maxTreeBytes = args.get('maxTreeBytes')
+        self.evictionPolicy = args.get('evictionPolicy', 'lru')  # 'lru' or 'visits'
+        self.budgeted = bool(self.maxTreeNodes or self.maxTreeBytes)
+        self.Ls = {}  # stores the tick in which board s was last visited (only when budgeted)
+        self.tick = 0
+        self.treeBytes = 0  # estimated size of the tree (only when budgeted)
+        self.numEvicted = 0  # boards evicted to stay within the budget
+
+        # optionally merge the symmetries of a board (game.getSymmetries) into one node
+        self.symmetricTree = args.get('symmetricTree', False)
+        self.actionIds = np.arange(game.getActionSize())
+
+        # optional Gumbel root search (see gumbelSearch) for small numMCTSSims
+        self.gumbel = args.get('gumbel', False)
+        self.gumbelK = args.get('gumbelK', 16)  # actions sampled at the root
+        self.gumbelCVisit = args.get('gumbelCVisit', 50)
+        self.gumbelCScale = args.get('gumbelCScale', 1.0)
+
+        # optional Dirichlet noise mixed into the root priors for the duration of a search
+        self.rootDirichletAlpha = args.get('rootDirichletAlpha')
+        self.rootNoiseFraction = args.get('rootNoiseFraction', 0.25)
+
+        # optional instrumentation: a SearchStats per getActionProb call, passed to onStats
+        self.collectStats = args.get('collectStats', False)
+        self.stats = None  # stats of the last (or current) getActionProb call
+        self.onStats = None
+        if self.collectStats:
+            self.game = TimedCalls(game, self, 'gameTime', GAME_LOGIC)
+            self.nnet = TimedCalls(nnet, self, 'predictTime', ('predict', 'predict_batch'))
 
-    def getActionProb(self, canonicalBoard, temp=1):
+        self.numExpanded = 0  # boards expanded so far
+        self.lastSearchSims = 0  # simulations run by the last getActionProb call
+        self.lastBestAction = None  # the action that won the sequential halving of the last gumbel search
+        self.simsSaved = 0  # simulations of the numMCTSSims budget skipped by args.earlyStop
+
+    def getActionProb(self, canonicalBoard, temp=1, numSims=None):
         """
-        This function performs numMCTSSims simulations of MCTS starting from
-        canonicalBoard.
+        This function performs simulations of MCTS starting from
+        canonicalBoard until the search budget is spent (see runSimulations).
+        numSims, if given, replaces args.numMCTSSims for this call. The
+        number of simulations run is left in lastSearchSims.
+
+        With args.earlyStop, a board with a single valid move is not searched
+        at all, and for temp=0 the search stops as soon as the most visited
+        action can no longer be overtaken within numMCTSSims.
+
+        With args.symmetricTree the search runs on the symmetry of
+        canonicalBoard with the smallest key, and the visit counts are
+        permuted back to the orientation of canonicalBoard.
+
+        With args.mctsSolver the search stops once canonicalBoard is proven
+        won or lost, and a proven winning action is returned with
+        probability 1.
+
+        With args.gumbel the root is searched by gumbelSearch instead: for
+        temp > 0 the returned policy is the improved policy of the search
+        (raised to 1./temp), for temp = 0 it selects the action that won the
+        sequential halving. Either way that action is left in lastBestAction.
+
+        With args.rootDirichletAlpha, the root priors are mixed with
+        Dirichlet(rootDirichletAlpha) noise (weight args.rootNoiseFraction,
+        default 0.25) while the search runs, as in AlphaZero.
+
+        With args.collectStats, the SearchStats of the call are left in stats
+        and passed to onStats if it is set.
 
         Returns:
             probs: a policy vector where the probability of the ith action is
                    proportional to Nsa[(s,a)]**(1./temp)
         """
-        for i in range(self.args.numMCTSSims):
-            self.search(canonicalBoard)
+        if self.collectStats:
+            self.stats = SearchStats()
+            start = time.perf_counter()
+            firstNode = self.numExpanded
 
-        s = self.game.stringRepresentation(canonicalBoard)
-        counts = [self.Nsa[(s, a)] if (s, a) in self.Nsa else 0 for a in range(self.game.getActionSize())]
+        probs = None
+        self.lastBestAction = None
+        if self.args.get('earlyStop', False):
+            probs = self.forcedMove(canonicalBoard, numSims)
+        if probs is None:
+            probs = self.countsToProbs(self.getActionCounts(canonicalBoard, temp, numSims), temp)
+
+        if self.collectStats:
+            self.stats.numSearches = 1
+            self.stats.numSims = self.lastSearchSims
+            self.stats.nodesCreated = self.numExpanded - firstNode
+            self.stats.totalTime = time.perf_counter() - start
+            if self.onStats is not None:
+                self.onStats(self.stats)
+        return probs
 
+    def getActionCounts(self, canonicalBoard, temp=1, numSims=None):
+        """
+        Searches canonicalBoard as getActionProb does, without the forced
+        move shortcut.
+
+        Returns:
+            counts: the visit counts of the actions of canonicalBoard (the
+                    one-hot winning action of a proven win, the improved
+                    policy or halving winner with args.gumbel, the masked
+                    priors if the search never visited the root)
+        """
+        perm = None
+        if self.symmetricTree:
+            canonicalBoard, perm = self.symmetricForm(canonicalBoard)
+
+        s = self.boardKey(canonicalBoard)
+        priors = None
+        expandSims = 0
+        if self.rootDirichletAlpha and not self.gumbel:
+            if s not in self.Ps:
+                # expand the root first
+                self.search(canonicalBoard)
+                expandSims = 1
+            if s in self.Ps:
+                priors = self.Ps[s]
+                noise = np.random.dirichlet([self.rootDirichletAlpha] * len(priors))
+                self.Ps[s] = (1 - self.rootNoiseFraction) * priors + self.rootNoiseFraction * noise
+
+        if self.gumbel:
+            self.lastSearchSims, policy, best = self.gumbelSearch(canonicalBoard, noise=temp != 0, numSims=numSims)
+        else:
+            earlyStop = self.args.get('earlyStop', False) and temp == 0
+            if expandSims:
+                # the expansion of the root is part of the simulation budget
+                maxSims = numSims if numSims is not None else self.args.get('numMCTSSims')
+                if maxSims is not None:
+                    numSims = max(0, maxSims - expandSims)
+            self.lastSearchSims = expandSims + self.runSimulations(canonicalBoard, earlyStop=earlyStop, numSims=numSims)
+        if priors is not None and s in self.Ps:
+            self.Ps[s] = priors
+
+        if self.budgeted:
+            self.evict(keep=s)
+        counts = np.zeros(self.game.getActionSize(), dtype=np.int64)
+        if self.Ss.get(s) == 1:
+            counts[self.winningAction(s)] = 1
+        elif self.gumbel and policy is not None:
+            if temp == 0:
+                counts[self.As[s][best]] = 1
+            else:
+                counts = np.zeros(len(counts))
+                counts[self.As[s]] = policy
+        elif s in self.Nsa:
+            counts[self.As[s]] = self.Nsa[s]
+        if not counts.any() and s in self.Ps:
+            # the budget ran out before the root was visited
+            counts = np.zeros(len(counts))
+            counts[self.As[s]] = self.Ps[s]
+        if self.gumbel and (self.Ss.get(s) == 1 or best is not None):
+            self.lastBestAction = self.winningAction(s) if self.Ss.get(s) == 1 else int(self.As[s][best])
+        if perm is not None:
+            # back to the orientation of the board we were called with
+            counts = counts[np.argsort(perm)]
+            if self.lastBestAction is not None:
+                self.lastBestAction = int(perm[self.lastBestAction])
+        return counts
+
+    def forcedMove(self, canonicalBoard, numSims=None):
+        """
+        Returns:
+            probs: the policy playing the only valid move of canonicalBoard
+                   (counted as saved simulations), None if there are several
+        """
+        valids = self.game.getValidMoves(canonicalBoard, 1)
+        if np.sum(valids) != 1:
+            return None
+        self.lastSearchSims = 0
+        self.simsSaved += numSims or self.args.get('numMCTSSims') or 0
+        probs = [0] * len(valids)
+        probs[int(np.argmax(valids))] = 1
+        return probs
+
+    @staticmethod
+    def countsToProbs(counts, temp):
+        """
+        Turns the visit counts of getActionCounts into the policy returned by
+        getActionProb.
+        """
         if temp == 0:
             bestAs = np.array(np.argwhere(counts == np.max(counts))).flatten()
             bestA = np.random.choice(bestAs)
@@ -47,16 +326,164 @@ class MCTS():
             probs[bestA] = 1
             return probs
 
-        counts = [x ** (1. / temp) for x in counts]
-        counts_sum = float(sum(counts))
-        probs = [x / counts_sum for x in counts]
-        return probs
+        counts = counts ** (1. / temp)
+        probs = counts / float(np.sum(counts))
+        return probs.tolist()
 
-    def search(self, canonicalBoard):
+    def runSimulations(self, canonicalBoard, earlyStop=False, numSims=None):
         """
-        This function performs one iteration of MCTS. It is recursively called
-        till a leaf node is found. The action chosen at each node is one that
-        has the maximum upper confidence bound as in the paper.
+        Runs simulations from canonicalBoard until the first of the configured
+        budgets is spent:
+            args.numMCTSSims (or numSims): number of simulations
+            args.searchTimeMs: wall-clock time in milliseconds
+            args.maxNodesPerMove: number of newly expanded boards
+        but at least args.minMCTSSims (default 0) simulations, and the time
+        and node budgets only stop the search once the root has been
+        visited. If
+        args.leafBatchSize > 1 the simulations are run in rounds of that many
+        leaves, each round evaluated in one batched forward pass (see
+        searchBatch).
+
+        With earlyStop, the search also stops once the visit count gap between
+        the two most visited actions exceeds the simulations left in
+        numMCTSSims; the skipped simulations are added to simsSaved.
+
+        Returns:
+            numSims: the number of simulations run
+        """
+        budget = self.searchBudget(numSims)
+        leafBatchSize = self.args.get('leafBatchSize', 1)
+        root = self.boardKey(canonicalBoard)
+        numSims = 0
+        while not self.budgetSpent(root, numSims, budget, earlyStop):
+            if leafBatchSize > 1:
+                numLeaves = leafBatchSize
+                if budget.maxSims is not None:
+                    numLeaves = min(numLeaves, max(budget.maxSims, budget.minSims) - numSims)
+                numSims += self.searchBatch(canonicalBoard, numLeaves)
+            else:
+                self.search(canonicalBoard)
+                numSims += 1
+        return numSims
+
+    def searchBudget(self, numSims=None):
+        """
+        Starts the budget of one search (see runSimulations).
+        """
+        budget = dotdict({
+            'maxSims': numSims if numSims is not None else self.args.get('numMCTSSims'),
+            'minSims': self.args.get('minMCTSSims', 0),
+            'maxNodes': self.args.get('maxNodesPerMove'),
+            'deadline': None,
+            'firstNode': self.numExpanded,
+        })
+        searchTimeMs = self.args.get('searchTimeMs')
+        if budget.maxSims is None and searchTimeMs is None and budget.maxNodes is None:
+            raise ValueError('One of numMCTSSims, searchTimeMs or maxNodesPerMove must be set')
+        if searchTimeMs is not None:
+            budget.deadline = time.time() + searchTimeMs / 1000.
+        return budget
+
+    def budgetSpent(self, root, numSims, budget, earlyStop=False):
+        """
+        Returns:
+            spent: True if a search of root that has run numSims simulations
+                   must stop (see runSimulations)
+        """
+        if self.Ss.get(root):
+            # nothing left to search
+            return True
+        if numSims < budget.minSims:
+            return False
+        maxSims = budget.maxSims
+        if maxSims is not None and numSims >= maxSims:
+            return True
+        if earlyStop and maxSims is not None and len(self.Nsa.get(root, ())) > 1:
+            second, first = np.partition(self.Nsa[root], -2)[-2:]
+            if first - second > maxSims - numSims:
+                self.simsSaved += maxSims - numSims
+                return True
+        if self.Ns.get(root, 0) == 0 and self.Es.get(root, 0) == 0:
+            # the first simulation only expands the root, the time and node budgets wait for a visit
+            return False
+        if budget.deadline is not None and time.time() >= budget.deadline:
+            return True
+        return budget.maxNodes is not None and self.numExpanded - budget.firstNode >= budget.maxNodes
+
+    def gumbelSearch(self, canonicalBoard, noise=True, numSims=None):
+        """
+        Searches canonicalBoard with Gumbel top-k sampling and sequential
+        halving at the root (Danihelka et al., "Policy improvement by planning
+        with Gumbel"), which improves the policy even with a handful of
+        simulations. The args.gumbelK actions (at most as many as there are
+        simulations left) with the highest g + logits,
+        g being Gumbel noise (omitted if not noise), are considered. The
+        args.numMCTSSims simulations are then split over log2(gumbelK) phases;
+        each phase visits the remaining actions equally and keeps the better
+        half by g + logits + sigma(Q). Below the root, actions are selected
+        by PUCT as usual. numSims, if given, replaces args.numMCTSSims.
+
+        Returns:
+            numSims: the number of simulations run
+            policy: the improved policy softmax(logits + sigma(completed Q))
+                    over As[s], None if the board was not expanded
+            best: the index in As[s] of the action left by the halving
+        """
+        maxSims = numSims if numSims is not None else self.args.get('numMCTSSims')
+        if maxSims is None:
+            raise ValueError('args.gumbel requires numMCTSSims')
+        s = self.boardKey(canonicalBoard)
+        numSims = 0
+        if s not in self.Ps:
+            self.search(canonicalBoard)
+            numSims += 1
+        if s not in self.Ps:
+            # terminal or proven
+            return numSims, None, None
+
+        logits = np.log(self.Ps[s] + EPS)
+        g = np.random.gumbel(size=len(logits)) if noise else np.zeros(len(logits))
+        # m = min(gumbelK, n) actions, so that every considered action is visited at least once
+        considered = np.argsort(-(g + logits), kind='stable')[:min(self.gumbelK, max(1, maxSims - numSims))]
+        numPhases = max(1, math.ceil(math.log2(len(considered))))
+        while numSims < maxSims and not self.Ss.get(s):
+            perAction = max(1, maxSims // (numPhases * len(considered)))
+            for i in considered:
+                for _ in range(min(perAction, maxSims - numSims)):
+                    self.search(canonicalBoard, rootIndex=i)
+                    numSims += 1
+            if self.Ss.get(s) or numSims >= maxSims:
+                break
+            score = g[considered] + logits[considered] + self.gumbelSigma(s)[considered]
+            considered = considered[np.argsort(-score, kind='stable')[:math.ceil(len(considered) / 2)]]
+
+        best = considered[np.argmax(g[considered] + logits[considered] + self.gumbelSigma(s)[considered])]
+        policy = logits + self.gumbelSigma(s)
+        policy = np.exp(policy - np.max(policy))
+        return numSims, policy / np.sum(policy), int(best)
+
+    def gumbelSigma(self, s):
+        """
+        Returns sigma(completed Q) of the actions of board s: the Q values
+        rescaled to [0, 1], where unvisited actions get the prior weighted
+        mean Q of the visited ones, times (gumbelCVisit + max Nsa) *
+        gumbelCScale.
+        """
+        visited = self.Nsa[s] > 0
+        qs = self.Qsa[s]
+        if np.any(visited):
+            vMix = np.sum(self.Ps[s][visited] * qs[visited]) / np.sum(self.Ps[s][visited])
+            qs = np.where(visited, qs, vMix)
+        scale = (self.gumbelCVisit + np.max(self.Nsa[s])) * self.gumbelCScale
+        return scale * (qs + 1) / 2
+
+    def search(self, canonicalBoard, rootIndex=None):
+        """
+        This function performs one iteration of MCTS. It descends from
+        canonicalBoard till a leaf node is found, without recursion, keeping
+        the traversed edges in an explicit path. The action chosen at each
+        node is one that has the maximum upper confidence bound as in the
+        paper.
 
         Once a leaf node is found, the neural network is called to return an
         initial policy P and a value v for the state. This value is propagated
@@ -68,69 +495,389 @@ class MCTS():
         state. This is done since v is in [-1,1] and if v is the value of a
         state for the current player, then its value is -v for the other player.
 
+        If rootIndex is given, the descent starts with action As[s][rootIndex]
+        of the (expanded) canonicalBoard.
+
         Returns:
             v: the negative of the value of the current canonicalBoard
         """
+        path, board, s, v = self.selectLeaf(canonicalBoard, rootIndex=rootIndex)
 
-        s = self.game.stringRepresentation(canonicalBoard)
+        if v is None:
+            # leaf node
+            pi, v = self.nnet.predict(board)
+            self.expand(s, board, pi)
 
-        if s not in self.Es:
-            self.Es[s] = self.game.getGameEnded(canonicalBoard, 1)
-        if self.Es[s] != 0:
-            # terminal node
-            return -self.Es[s]
+        return -self.backup(path, v)
 
-        if s not in self.Ps:
-            # leaf node
-            self.Ps[s], v = self.nnet.predict(canonicalBoard)
-            valids = self.game.getValidMoves(canonicalBoard, 1)
-            self.Ps[s] = self.Ps[s] * valids  # masking invalid moves
-            sum_Ps_s = np.sum(self.Ps[s])
-            if sum_Ps_s > 0:
-                self.Ps[s] /= sum_Ps_s  # renormalize
+    def searchBatch(self, canonicalBoard, numLeaves):
+        """
+        This function performs up to numLeaves simulations of MCTS starting
+        from canonicalBoard, evaluating all the leaves they reach in a single
+        nnet.predict_batch call.
+
+        Every edge on a descent receives a virtual loss of args.virtualLoss
+        (default 1) visits valued -1, which steers the following descents of
+        the same round to other leaves. The virtual loss is removed again when
+        the real value is backed up. Descents that reach a leaf already
+        pending in this round share its evaluation. Collection stops early if
+        the root itself is the leaf.
+
+        Returns:
+            numSims: the number of simulations performed
+        """
+        pending, numSims = self.collectLeaves(canonicalBoard, numLeaves)
+        if pending:
+            pis, vs = self.nnet.predict_batch([board for board, _ in pending.values()])
+            self.expandLeaves(pending, pis, vs)
+        return numSims
+
+    def collectLeaves(self, canonicalBoard, numLeaves):
+        """
+        The first half of searchBatch: runs up to numLeaves descents with
+        virtual loss, backing up terminal and proven boards right away.
+
+        Returns:
+            pending: a dict from every leaf s still to be evaluated to
+                     (canonical board, search paths that reached it)
+            numSims: the number of simulations performed
+        """
+        virtualLoss = self.args.get('virtualLoss', 1)
+        pending = {}
+        numSims = 0
+
+        while numSims < numLeaves:
+            numSims += 1
+            path, board, s, v = self.selectLeaf(canonicalBoard, virtualLoss)
+            if v is not None:
+                # terminal or proven node
+                self.backup(path, v, virtualLoss)
+                continue
+            if s in pending:
+                pending[s][1].append(path)
             else:
-                # if all valid moves were masked make all valid moves equally probable
+                pending[s] = (board, [path])
+            if not path:
+                break
+        return pending, numSims
+
+    def expandLeaves(self, pending, pis, vs):
+        """
+        The second half of searchBatch: expands the leaves collected by
+        collectLeaves with their evaluations pis, vs (in the order of
+        pending) and backs the values up every path that reached them.
+        """
+        virtualLoss = self.args.get('virtualLoss', 1)
+        for (s, (board, paths)), pi, v in zip(pending.items(), pis, vs):
+            self.expand(s, board, pi)
+            for path in paths:
+                self.backup(path, v, virtualLoss)
+
+    def selectLeaf(self, canonicalBoard, virtualLoss=0, rootIndex=None):
+        """
+        Descends from canonicalBoard along the edges with the highest upper
+        confidence bound until it reaches a terminal, proven (see backup) or
+        unexpanded board, adding virtualLoss to every edge it traverses. A
+        board repeated on the way down (e.g. Tafl keys ignore the move
+        counter) ends the descent as a draw instead of looping forever. If
+        rootIndex is given, it is the action taken at canonicalBoard.
+
+        Returns:
+            path: the list of edges traversed, as (s, i) with action As[s][i]
+            board: the canonical board reached
+            s: its key (Es[s] is filled in)
+            v: the value of the board for its player if it is terminal or
+               proven, None if it still has to be evaluated
+        """
+        path = []
+        onPath = set()
+        self.tick += 1
+        while True:
+            if self.symmetricTree:
+                canonicalBoard, _ = self.symmetricForm(canonicalBoard)
+            s = self.boardKey(canonicalBoard)
+            if path:
+                self.Cs[path[-1][0]][path[-1][1]] = s
+            if s in onPath:
+                # repetition
+                v = 0
+                break
+            onPath.add(s)
+            if s not in self.Es:
+                self.Es[s] = self.game.getGameEnded(canonicalBoard, 1)
+                if self.budgeted:
+                    self.treeBytes += self.nodeBytes(s)
+                if self.mctsSolver and abs(self.Es[s]) == 1:
+                    self.Ss[s] = self.Es[s]
+            if self.budgeted:
+                self.Ls[s] = self.tick
+            if self.Es[s] != 0:
+                # terminal node
+                v = self.Es[s]
+                break
+            if s in self.Ss:
+                # proven node
+                v = self.Ss[s]
+                break
+            if s not in self.Ps:
+                v = None
+                break
+
+            i = self.selectAction(s) if rootIndex is None or path else rootIndex
+            path.append((s, i))
+            if virtualLoss:
+                n = self.Nsa[s][i]
+                self.Qsa[s][i] = (n * self.Qsa[s][i] - virtualLoss) / (n + virtualLoss)
+                self.Nsa[s][i] = n + virtualLoss
+                self.Ns[s] += virtualLoss
+
+            next_s, next_player = self.game.getNextState(canonicalBoard, 1, self.As[s][i])
+            canonicalBoard = self.game.getCanonicalForm(next_s, next_player)
+
+        if self.stats is not None:
+            self.stats.numDescents += 1
+            self.stats.depthSum += len(path)
+            self.stats.maxDepth = max(self.stats.maxDepth, len(path))
+            if self.Es.get(s, 0) != 0:
+                self.stats.terminalHits += 1
+        return path, canonicalBoard, s, v
+
+    def backup(self, path, v, virtualLoss=0):
+        """
+        Propagates the value v of the board reached by path up the path,
+        negating it at every ply and replacing the virtualLoss that
+        selectLeaf added to every edge by one real visit.
+
+        With args.mctsSolver, proofs are propagated up the path as well: a
+        board is proven won if one of its actions leads to a board proven
+        lost for the opponent, and proven lost if all its valid actions lead
+        to boards proven won for the opponent. From a newly proven board on,
+        its proven value is backed up instead of v.
+
+        Returns:
+            v: the value of the board path starts from, for its current player
+        """
+        for s, i in reversed(path):
+            v = -v
+            n = self.Nsa[s][i]
+            self.Qsa[s][i] = (n * self.Qsa[s][i] + virtualLoss + v) / (n - virtualLoss + 1)
+            self.Nsa[s][i] = n - virtualLoss + 1
+            self.Ns[s] += 1 - virtualLoss
+            if self.mctsSolver and self.prove(s, i):
+                v = self.Ss[s]
+        return v
+
+    def prove(self, s, i):
+        """
+        Updates the proof status of board s after a visit of its ith edge.
+
+        Returns:
+            proven: True if s is proven won or lost
+        """
+        if s in self.Ss:
+            return True
+        child = self.Ss.get(self.Cs[s].get(i))
+        if child == -1:
+            self.Ss[s] = 1
+            self.Ws[s] = i
+        elif child == 1 and all(self.Ss.get(self.Cs[s].get(j)) == 1 for j in range(len(self.As[s]))):
+            self.Ss[s] = -1
+        return s in self.Ss
 
-                # NB! All valid moves may be masked if either your NNet architecture is insufficient or you've get overfitting or something else.
-                # If you have got dozens or hundreds of these messages you should pay attention to your NNet and/or training process.   
-                log.error("All valid moves were masked, doing a workaround.")
-                self.Ps[s] = self.Ps[s] + valids
-                self.Ps[s] /= np.sum(self.Ps[s])
+    def winningAction(self, s):
+        """
+        Returns the action of the proven won board s leading to a board proven
+        lost for the opponent, recorded by prove (the losing board itself may
+        have been evicted since).
+        """
+        return self.As[s][self.Ws[s]]
 
-            self.Vs[s] = valids
-            self.Ns[s] = 0
-            return -v
+    def expand(self, s, canonicalBoard, pi):
+        """
+        Adds the leaf board s to the tree with the policy pi returned by the
+        neural net, restricted to the valid moves and renormalized.
+        """
+        if self.budgeted:
+            self.treeBytes -= self.nodeBytes(s)
+        actions = np.flatnonzero(self.game.getValidMoves(canonicalBoard, 1))
+        self.Ps[s] = pi[actions]  # masking invalid moves
+        sum_Ps_s = np.sum(self.Ps[s])
+        if sum_Ps_s > 0:
+            self.Ps[s] /= sum_Ps_s  # renormalize
+        else:
+            # if all valid moves were masked make all valid moves equally probable
 
-        valids = self.Vs[s]
-        cur_best = -float('inf')
-        best_act = -1
+            # NB! All valid moves may be masked if either your NNet architecture is insufficient or you've get overfitting or something else.
+            # If you have got dozens or hundreds of these messages you should pay attention to your NNet and/or training process.   
+            log.error("All valid moves were masked, doing a workaround.")
+            self.Ps[s] = np.ones(len(actions)) / len(actions)
 
-        # pick the action with the highest upper confidence bound
-        for a in range(self.game.getActionSize()):
-            if valids[a]:
-                if (s, a) in self.Qsa:
-                    u = self.Qsa[(s, a)] + self.args.cpuct * self.Ps[s][a] * math.sqrt(self.Ns[s]) / (
-                            1 + self.Nsa[(s, a)])
-                else:
-                    u = self.args.cpuct * self.Ps[s][a] * math.sqrt(self.Ns[s] + EPS)  # Q = 0 ?
+        if self.progressiveWidening:
+            # highest prior first, so the eligible actions are a prefix of As[s]
+            order = np.argsort(-self.Ps[s], kind='stable')
+            actions = actions[order]
+            self.Ps[s] = self.Ps[s][order]
 
-                if u > cur_best:
-                    cur_best = u
-                    best_act = a
+        self.As[s] = actions
+        self.Ns[s] = 0
+        self.Nsa[s] = np.zeros(len(actions), dtype=np.int64)
+        self.Qsa[s] = np.zeros(len(actions))
+        self.Cs[s] = {}
+        self.numExpanded += 1
+        if self.budgeted:
+            self.treeBytes += self.nodeBytes(s)
 
-        a = best_act
-        next_s, next_player = self.game.getNextState(canonicalBoard, 1, a)
-        next_s = self.game.getCanonicalForm(next_s, next_player)
+    def advanceRoot(self, canonicalBoard):
+        """
+        Makes canonicalBoard the root of the tree: the boards reachable from it
+        through traversed edges keep their statistics, every other board is
+        freed. Call it once per move so searches start with the visits already
+        spent on the position and the tree does not outgrow the game.
 
-        v = self.search(next_s)
+        Returns:
+            numFreed: the number of boards removed from the tree
+        """
+        if self.symmetricTree:
+            canonicalBoard, _ = self.symmetricForm(canonicalBoard)
+        keep = set()
+        stack = [self.boardKey(canonicalBoard)]
+        while stack:
+            s = stack.pop()
+            if s not in keep:
+                keep.add(s)
+                stack.extend(self.Cs.get(s, {}).values())
 
-        if (s, a) in self.Qsa:
-            self.Qsa[(s, a)] = (self.Nsa[(s, a)] * self.Qsa[(s, a)] + v) / (self.Nsa[(s, a)] + 1)
-            self.Nsa[(s, a)] += 1
+        freed = [s for s in self.Es if s not in keep]
+        for s in freed:
+            self.deleteNode(s)
+        return len(freed)
 
+    def symmetricForm(self, canonicalBoard):
+        """
+        Picks the representative of canonicalBoard among its symmetries (as
+        given by game.getSymmetries): the one with the smallest key. All
+        symmetric positions thus share one node and one network evaluation.
+
+        Returns:
+            board: the representative board
+            perm: an array such that action a on board is action perm[a] on
+                  canonicalBoard
+        """
+        board, perm = min(self.game.getSymmetries(canonicalBoard, self.actionIds),
+                          key=lambda sym: self.boardKey(sym[0]))
+        return board, np.asarray(perm)
+
+    def deleteNode(self, s):
+        """
+        Removes board s and the statistics of its outgoing edges from the tree.
+        """
+        if self.budgeted:
+            self.treeBytes -= self.nodeBytes(s)
+        for table in (self.As, self.Qsa, self.Nsa, self.Ns, self.Ps, self.Es, self.Cs, self.Ss, self.Ws, self.Ls):
+            table.pop(s, None)
+
+    def clear(self):
+        """
+        Frees the whole tree, e.g. between games.
+        """
+        for table in (self.As, self.Qsa, self.Nsa, self.Ns, self.Ps, self.Es, self.Cs, self.Ss, self.Ws, self.Ls):
+            table.clear()
+        self.treeBytes = 0
+
+    def nodeBytes(self, s):
+        """
+        Returns an estimate of the memory held by board s in the tree.
+        """
+        size = sys.getsizeof(s) + NODE_OVERHEAD
+        if s in self.Ps:
+            size += self.As[s].nbytes + self.Ps[s].nbytes + self.Nsa[s].nbytes + self.Qsa[s].nbytes
+        return size
+
+    def evict(self, keep):
+        """
+        Evicts boards until the tree is within args.maxTreeNodes and
+        args.maxTreeBytes again. Boards are evicted least recently visited
+        first (evictionPolicy 'lru') or least visited first ('visits'); the
+        board keep (the current root) is never evicted. To avoid evicting on
+        every move, the tree is shrunk to 90% of the budget.
+
+        An evicted board that is reached again is simply re-expanded as a leaf.
+        """
+        numOver = 0
+        if self.maxTreeNodes and len(self.Es) > self.maxTreeNodes:
+            numOver = len(self.Es) - int(0.9 * self.maxTreeNodes)
+        if self.maxTreeBytes and self.treeBytes > self.maxTreeBytes:
+            bytesOver = self.treeBytes - 0.9 * self.maxTreeBytes
+            numOver = max(numOver, math.ceil(bytesOver * len(self.Es) / self.treeBytes))
+        if numOver <= 0:
+            return
+
+        if self.evictionPolicy == 'lru':
+            priority = lambda s: self.Ls.get(s, 0)
+        elif self.evictionPolicy == 'visits':
+            priority = lambda s: self.Ns.get(s, 0)
         else:
-            self.Qsa[(s, a)] = v
-            self.Nsa[(s, a)] = 1
+            raise ValueError(f'Unknown evictionPolicy {self.evictionPolicy}')
+
+        victims = heapq.nsmallest(numOver, (s for s in self.Es if s != keep), key=priority)
+        for s in victims:
+            self.deleteNode(s)
+        self.numEvicted += len(victims)
+        log.debug(f'Evicted {len(victims)} boards, {len(self.Es)} left (~{self.treeBytes} bytes)')
+
+    def selectAction(self, s):
+        """
+        Picks the valid action with the highest upper confidence bound from
+        board s with a single vectorized pass over its per-action arrays.
+        Unvisited edges have Q = 0. With progressive widening only the first
+        k(Ns[s]) actions of As[s] (the ones with the highest prior) compete.
+
+        Returns:
+            i: the index of the action in As[s]
+        """
+        # actions proven to lose are skipped (s itself is not proven lost, so one is left)
+        losing = [i for i, c in self.Cs[s].items() if self.Ss.get(c) == 1] if self.mctsSolver else []
+
+        k = len(self.As[s])
+        if self.progressiveWidening:
+            k = min(k, math.ceil(self.pwConstant * (self.Ns[s] + 1) ** self.pwExponent) + len(losing))
+        u = self.Qsa[s][:k] + self.args.cpuct * self.Ps[s][:k] * math.sqrt(self.Ns[s] + EPS) / (1 + self.Nsa[s][:k])
+        for i in losing:
+            if i < k:
+                u[i] = -np.inf
+        return int(np.argmax(u))
+
+
+class MCTSPlayer():
+    """
+    A player for Arena that plays the action most visited by an MCTS search.
+    Arena calls advanceRoot before every move, so the subtree of the position
+    actually reached is reused and the rest of the tree is freed. With
+    args.clearTreeBetweenGames the tree is also dropped at the start of
+    every game. The number of simulations args.earlyStop saved in every game
+    is appended to simsSavedPerGame. With args.collectStats, the SearchStats
+    of all its searches are merged into stats.
+    """
+
+    def __init__(self, mcts, temp=0):
+        self.mcts = mcts
+        self.temp = temp
+        self.simsSavedPerGame = []
+        self.stats = None
+        if getattr(mcts, 'collectStats', False):
+            self.stats = SearchStats()
+            mcts.onStats = self.stats.merge
+
+    def __call__(self, canonicalBoard):
+        return np.argmax(self.mcts.getActionProb(canonicalBoard, temp=self.temp))
+
+    def startGame(self):
+        if self.mcts.args.get('clearTreeBetweenGames', False):
+            self.mcts.clear()
+        self.simsSavedAtStart = self.mcts.simsSaved
+
+    def endGame(self):
+        self.simsSavedPerGame.append(self.mcts.simsSaved - self.simsSavedAtStart)
 
-        self.Ns[s] += 1
-        return -v
+    def advanceRoot(self, canonicalBoard):
+        self.mcts.advanceRoot(canonicalBoard)
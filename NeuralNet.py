@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class NeuralNet():
     """
     This class specifies the base NeuralNet class. To define your own neural
@@ -36,6 +39,24 @@ class NeuralNet():
         """
         pass
 
+    def predict_batch(self, boards):
+        """
+        Input:
+            boards: a list of boards in their canonical form.
+
+        Returns:
+            pis: an array of shape (len(boards), game.getActionSize) with one
+                 policy vector per board
+            vs: an array of shape (len(boards),) with one value per board
+
+        The default implementation calls predict on every board; override it
+        to evaluate all boards in one forward pass.
+        """
+        results = [self.predict(board) for board in boards]
+        pis = np.array([pi for pi, _ in results])
+        vs = np.array([v for _, v in results], dtype=np.float64).reshape(len(boards))
+        return pis, vs
+
     def save_checkpoint(self, folder, filename):
         """
         Saves the current neural network (with its parameters) in
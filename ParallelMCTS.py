@@ -0,0 +1,182 @@
+import logging
+import multiprocessing as mp
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from MCTS import MCTS
+
+log = logging.getLogger(__name__)
+
+
+class ThreadedMCTS(MCTS):
+    """
+    An MCTS in which args.numThreads (default 4) threads run the simulations
+    of one search concurrently on the shared tree (tree parallelization).
+
+    Selection and backup hold a single tree lock; they are short, and under
+    the GIL finer locks per node would cost more than they save. The lock is
+    released while a leaf is evaluated by nnet.predict, which for torch
+    networks releases the GIL, so the evaluations of all the threads overlap
+    with each other and with the tree work. Edges on the way to a leaf under
+    evaluation carry a virtual loss of args.virtualLoss (default 1) so the
+    other threads spread out; a thread reaching a leaf that is already being
+    evaluated evaluates it too but does not expand it a second time.
+
+    nnet.predict must be safe to call from several threads (the pytorch
+    wrappers are; CachedNNet is not). Gumbel root search runs on the calling
+    thread only.
+    """
+
+    def __init__(self, game, nnet, args):
+        super().__init__(game, nnet, args)
+        self.numThreads = args.get('numThreads', 4)
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=self.numThreads)
+
+    def runSimulations(self, canonicalBoard, earlyStop=False, numSims=None):
+        """
+        Runs the simulations of MCTS.runSimulations on numThreads threads.
+
+        Returns:
+            numSims: the number of simulations run
+        """
+        budget = self.searchBudget(numSims)
+        root = self.boardKey(canonicalBoard)
+        numSims = 0
+        if not self.budgetSpent(root, numSims, budget, earlyStop) and root not in self.Ps:
+            # expand the root before the threads start
+            self.search(canonicalBoard)
+            numSims = 1
+        virtualLoss = self.args.get('virtualLoss', 1)
+
+        def simulate():
+            nonlocal numSims
+            while True:
+                with self.lock:
+                    if self.budgetSpent(root, numSims, budget, earlyStop):
+                        return
+                    numSims += 1
+                    path, board, s, v = self.selectLeaf(canonicalBoard, virtualLoss)
+                if v is None:
+                    # leaf node
+                    pi, v = self.nnet.predict(board)
+                    with self.lock:
+                        if s not in self.Ps:
+                            self.expand(s, board, pi)
+                        self.backup(path, v, virtualLoss)
+                else:
+                    with self.lock:
+                        self.backup(path, v, virtualLoss)
+
+        for future in [self.executor.submit(simulate) for _ in range(self.numThreads)]:
+            future.result()
+        return numSims
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock'], state['executor']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=self.numThreads)
+
+
+def rootWorkerLoop(conn, game, nnet, args, seed):
+    """
+    The loop of a RootParallelMCTS worker process: keeps an MCTS of its own
+    and answers ('search', canonicalBoard, temp, numSims) with the visit
+    counts and number of simulations of its search and whether it proved
+    the board won, and ('clear',) by dropping its tree, until it receives
+    None.
+    """
+    np.random.seed(seed)
+    mcts = MCTS(game, nnet, args)
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        if message[0] == 'clear':
+            mcts.clear()
+            continue
+        _, canonicalBoard, temp, numSims = message
+        mcts.advanceRoot(canonicalBoard)
+        counts = mcts.getActionCounts(canonicalBoard, temp, numSims)
+        root = mcts.symmetricForm(canonicalBoard)[0] if mcts.symmetricTree else canonicalBoard
+        conn.send((counts, mcts.lastSearchSims, mcts.Ss.get(mcts.boardKey(root)) == 1))
+
+
+class RootParallelMCTS():
+    """
+    Searches the same root in args.numProcesses (default cpu_count())
+    worker processes at once (root parallelization) and sums their root
+    visit counts before the move is chosen. The workers are started once,
+    with the game, network and args, and keep their own trees between
+    moves, so neither the network nor the tree is rebuilt per move.
+
+    Each worker seeds numpy with args.seed (default 0) plus its index; the
+    searches of a deterministic network only differ through randomness at
+    the root, so set args.rootDirichletAlpha (see MCTS.getActionProb) for
+    them to explore different lines. Every worker searches with the full
+    budget, so P workers run about P times the simulations in the same
+    wall-clock time.
+
+    It can be used in place of an MCTS by MCTSPlayer. Call close when done.
+    """
+
+    def __init__(self, game, nnet, args):
+        self.game = game
+        self.args = args
+        self.numProcesses = args.get('numProcesses', mp.cpu_count())
+        seed = args.get('seed', 0)
+        self.conns = []
+        self.workers = []
+        for i in range(self.numProcesses):
+            conn, workerConn = mp.Pipe()
+            worker = mp.Process(target=rootWorkerLoop, args=(workerConn, game, nnet, args, seed + i), daemon=True)
+            worker.start()
+            self.conns.append(conn)
+            self.workers.append(worker)
+        self.lastSearchSims = 0
+        self.simsSaved = 0
+
+    def getActionProb(self, canonicalBoard, temp=1, numSims=None):
+        """
+        Returns:
+            probs: the policy of MCTS.getActionProb for the summed visit
+                   counts of all the workers
+        """
+        if self.args.get('earlyStop', False):
+            valids = self.game.getValidMoves(canonicalBoard, 1)
+            if np.sum(valids) == 1:
+                # forced move
+                self.lastSearchSims = 0
+                self.simsSaved += numSims or self.args.get('numMCTSSims') or 0
+                return MCTS.countsToProbs(np.asarray(valids), temp)
+
+        for conn in self.conns:
+            conn.send(('search', canonicalBoard, temp, numSims))
+        results = [conn.recv() for conn in self.conns]
+        self.lastSearchSims = sum(numSims for _, numSims, _ in results)
+        for counts, _, provenWin in results:
+            if provenWin:
+                # the one-hot winning action, not to be outvoted by the visit counts of the others
+                return MCTS.countsToProbs(counts, temp)
+        return MCTS.countsToProbs(np.sum([counts for counts, _, _ in results], axis=0), temp)
+
+    def advanceRoot(self, canonicalBoard):
+        # every worker advances its own tree when it is asked to search
+        return 0
+
+    def clear(self):
+        for conn in self.conns:
+            conn.send(('clear',))
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+        for worker in self.workers:
+            worker.join()
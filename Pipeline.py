@@ -0,0 +1,90 @@
+import logging
+import queue
+import time
+
+import numpy as np
+
+from Arena import Arena
+from CachedNNet import CachedNNet
+from MCTS import MCTS, MCTSPlayer, SearchStats
+from SelfPlay import executeEpisode
+
+log = logging.getLogger(__name__)
+
+BEST_FILE = 'best.pth.tar'
+
+
+def getBestFile(version):
+    """
+    Returns the checkpoint of the version-th best network of the pipeline.
+    Every version gets its own file, written completely before the version
+    is published, so a process can never load a partly written one.
+    """
+    return 'best_' + str(version) + '.pth.tar'
+
+
+def selfPlayLoop(game, nnetClass, args, bestVersion, games, seed):
+    """
+    The loop of a self-play process of Coach.learnAsync: plays episodes with
+    the current best network forever, loading getBestFile(bestVersion)
+    whenever bestVersion changes, and puts (trainExamples, stats) of every finished
+    game on the games queue.
+    """
+    np.random.seed(seed)
+    games.cancel_join_thread()  # the process is terminated with games possibly still queued
+    nnet = nnetClass(game)
+    if args.get('nnetCacheSize'):
+        nnet = CachedNNet(nnet, game, args.nnetCacheSize, args.get('hashKeys', False))
+    loaded = 0
+    while True:
+        version = bestVersion.value
+        if version != loaded:
+            nnet.load_checkpoint(folder=args.checkpoint, filename=getBestFile(version))
+            loaded = version
+        mcts = MCTS(game, nnet, args)
+        stats = SearchStats()
+        mcts.onStats = stats.merge
+        games.put((executeEpisode(game, mcts, args), stats))
+
+
+def arenaLoop(game, nnetClass, args, candidates, results, bestVersion):
+    """
+    The loop of the gating process of Coach.learnAsync: pits every candidate
+    checkpoint taken from the candidates queue (only the newest one if
+    several are waiting) against the best network, and promotes it if it
+    wins at least updateThreshold of the decided games: it is saved as the
+    next getBestFile version (and as BEST_FILE) before bestVersion is
+    bumped. The outcome of every match is put on the results queue. Stops
+    on None, once the candidates queued before it have been gated.
+    """
+    nnet = nnetClass(game)
+    pnet = nnetClass(game)
+    pnet.load_checkpoint(folder=args.checkpoint, filename=getBestFile(bestVersion.value))
+    stop = False
+    while not stop:
+        waiting = [candidates.get()]
+        try:
+            while True:
+                waiting.append(candidates.get_nowait())
+        except queue.Empty:
+            pass
+        stop = None in waiting
+        waiting = [candidate for candidate in waiting if candidate is not None]
+        if not waiting:
+            continue
+        candidate = waiting[-1]
+
+        start = time.time()
+        nnet.load_checkpoint(folder=args.checkpoint, filename=candidate)
+        pplayer = MCTSPlayer(MCTS(game, pnet, args))
+        nplayer = MCTSPlayer(MCTS(game, nnet, args))
+        pwins, nwins, draws = Arena(pplayer, nplayer, game).playGames(args.arenaCompare)
+
+        accepted = pwins + nwins > 0 and float(nwins) / (pwins + nwins) >= args.updateThreshold
+        if accepted:
+            nnet.save_checkpoint(folder=args.checkpoint, filename=getBestFile(bestVersion.value + 1))
+            nnet.save_checkpoint(folder=args.checkpoint, filename=BEST_FILE)
+            with bestVersion.get_lock():
+                bestVersion.value += 1
+            nnet, pnet = pnet, nnet
+        results.put((candidate, pwins, nwins, draws, accepted, time.time() - start))
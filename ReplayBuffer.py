@@ -0,0 +1,122 @@
+import logging
+from collections import deque
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class ReplayBuffer():
+    """
+    The training examples of the latest iterations, stored in preallocated
+    arrays of boards, pis and vs (float32) instead of lists of tuples.
+
+    The arrays are a ring of capacity examples: the examples of a new
+    iteration are written after the previous ones, overwriting the oldest
+    when the ring is full, and whole iterations are dropped once there are
+    more than window of them. Training batches are sampled with one fancy
+    index per array, without ever building a list of all the examples.
+
+    Only games whose boards are numpy arrays of game.getBoardSize() are
+    supported (not Tafl).
+    """
+
+    def __init__(self, boardShape, actionSize, capacity, window):
+        self.boardShape = tuple(boardShape)
+        self.actionSize = actionSize
+        self.capacity = capacity
+        self.window = window
+        # np.empty only commits memory as the ring fills up
+        self.boards = np.empty((capacity,) + self.boardShape, dtype=np.float32)
+        self.pis = np.empty((capacity, actionSize), dtype=np.float32)
+        self.vs = np.empty(capacity, dtype=np.float32)
+        self.head = 0  # where the next example is written
+        self.iterationSizes = deque()  # examples of every iteration in the buffer, oldest first
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, examples):
+        """
+        Adds the examples of an iteration, a sequence of (board, pi, v).
+        """
+        examples = list(examples)[-self.capacity:]
+        if not examples:
+            self.addArrays(np.empty((0,) + self.boardShape), np.empty((0, self.actionSize)), np.empty(0))
+            return
+        boards, pis, vs = zip(*examples)
+        self.addArrays(np.asarray(boards), np.asarray(pis), np.asarray(vs))
+
+    def addArrays(self, boards, pis, vs):
+        """
+        Adds the examples of an iteration given as arrays of boards, pis and vs.
+        """
+        if boards.shape[1:] != self.boardShape:
+            raise ValueError(f'ReplayBuffer only supports boards of shape {self.boardShape}, got {boards.shape[1:]}')
+        n = min(len(boards), self.capacity)
+        boards, pis, vs = boards[-n:], pis[-n:], vs[-n:]
+        index = (self.head + np.arange(n)) % self.capacity
+        self.boards[index] = boards
+        self.pis[index] = pis
+        self.vs[index] = np.reshape(vs, -1)
+        self.head = (self.head + n) % self.capacity
+
+        self.iterationSizes.append(n)
+        self.size += n
+        # the ring overwrote the oldest examples
+        overflow = self.size - self.capacity
+        while overflow > 0:
+            dropped = min(overflow, self.iterationSizes[0])
+            self.iterationSizes[0] -= dropped
+            self.size -= dropped
+            overflow -= dropped
+            if self.iterationSizes[0] == 0:
+                self.iterationSizes.popleft()
+        while len(self.iterationSizes) > self.window:
+            self.size -= self.iterationSizes.popleft()
+
+    def indices(self):
+        """
+        Returns:
+            index: the positions of the examples in the ring, oldest first
+        """
+        return (self.head - self.size + np.arange(self.size)) % self.capacity
+
+    def sample(self, batchSize):
+        """
+        Returns:
+            boards, pis, vs: arrays of batchSize examples drawn uniformly at
+                             random (with replacement)
+        """
+        index = (self.head - 1 - np.random.randint(self.size, size=batchSize)) % self.capacity
+        return self.boards[index], self.pis[index], self.vs[index]
+
+    def arrays(self):
+        """
+        Returns:
+            boards, pis, vs: copies of all the examples, oldest first
+        """
+        index = self.indices()
+        return self.boards[index], self.pis[index], self.vs[index]
+
+    def iteration(self, k):
+        """
+        Returns:
+            boards, pis, vs: copies of the examples of the k-th iteration in
+                             the buffer (oldest first, negative k from the
+                             newest)
+        """
+        sizes = list(self.iterationSizes)
+        k %= len(sizes)
+        start = self.head - self.size + sum(sizes[:k])
+        index = (start + np.arange(sizes[k])) % self.capacity
+        return self.boards[index], self.pis[index], self.vs[index]
+
+    def iterations(self):
+        """
+        Returns:
+            iterations: (boards, pis, vs) arrays of every iteration in the
+                        buffer, oldest first
+        """
+        return [self.iteration(k) for k in range(len(self.iterationSizes))]
@@ -0,0 +1,403 @@
+import asyncio
+import logging
+import multiprocessing as mp
+
+import numpy as np
+
+from AsyncMCTS import AsyncMCTS, BatchEvaluator
+from CachedNNet import CachedNNet
+from InferenceServer import InferenceServer
+from MCTS import MCTS, SearchStats
+from utils import dotdict
+
+log = logging.getLogger(__name__)
+
+
+def moveBudget(args):
+    """
+    Draws whether the next move gets the full search and is recorded as a
+    training example (always, unless args.playoutCapFraction is set).
+
+    Returns:
+        fullSearch: True for a full search
+        numSims: the simulations of the search (None for args.numMCTSSims)
+    """
+    fullSearch = True
+    if args.get('playoutCapFraction') is not None:
+        fullSearch = np.random.random() < args.playoutCapFraction
+    return fullSearch, None if fullSearch else args.get('numMCTSSimsFast', 5)
+
+
+def recordMove(game, trainExamples, canonicalBoard, curPlayer, pi):
+    """
+    Appends the policy pi of canonicalBoard, in all its symmetries, to
+    trainExamples; the values are filled in by gameResult.
+    """
+    for b, p in game.getSymmetries(canonicalBoard, pi):
+        trainExamples.append([b, curPlayer, p, None])
+
+
+def chooseAction(mcts, pi, args):
+    """
+    Returns the action to play after the search of mcts returned the policy
+    pi: sampled from pi, except with args.gumbel, where the action that won
+    the sequential halving (with Gumbel noise, so still exploring) is played
+    as in the paper, whatever tempThreshold says; pi is then only the
+    training target.
+    """
+    if args.get('gumbel', False) and mcts.lastBestAction is not None:
+        return mcts.lastBestAction
+    return np.random.choice(len(pi), p=pi)
+
+
+def gameResult(game, board, curPlayer, trainExamples):
+    """
+    Returns:
+        trainExamples: the examples of the form (canonicalBoard, pi, v) of
+                       the game if it has ended at board, else None
+    """
+    r = game.getGameEnded(board, curPlayer)
+    if r == 0:
+        return None
+    return [(x[0], x[2], r * ((-1) ** (x[1] != curPlayer))) for x in trainExamples]
+
+
+def executeEpisode(game, mcts, args):
+    """
+    Plays one episode of self-play with mcts (see Coach.executeEpisode).
+
+    Returns:
+        trainExamples: a list of examples of the form (canonicalBoard, pi, v)
+    """
+    trainExamples = []
+    board = game.getInitBoard()
+    curPlayer = 1
+    episodeStep = 0
+
+    while True:
+        episodeStep += 1
+        canonicalBoard = game.getCanonicalForm(board, curPlayer)
+        temp = int(episodeStep < args.tempThreshold)
+
+        mcts.advanceRoot(canonicalBoard)
+        fullSearch, numSims = moveBudget(args)
+
+        # with gumbel the target is always the improved policy
+        pi = mcts.getActionProb(canonicalBoard, temp=1 if args.get('gumbel', False) else temp, numSims=numSims)
+        if fullSearch:
+            recordMove(game, trainExamples, canonicalBoard, curPlayer, pi)
+
+        action = chooseAction(mcts, pi, args)
+        board, curPlayer = game.getNextState(board, curPlayer, action)
+
+        examples = gameResult(game, board, curPlayer, trainExamples)
+        if examples is not None:
+            return examples
+
+
+WEIGHTS_FILE = 'selfplay.pth.tar'  # in args.checkpoint, the weights SelfPlayWorkers play with
+
+worker = None  # the state of a SelfPlayWorkers process
+
+
+def initSelfPlayWorker(game, nnetClass, args, version, server):
+    """
+    Sets a SelfPlayWorkers process up: its network (or its connection to the
+    inference server) is built once and kept for the lifetime of the
+    process.
+    """
+    global worker
+    nnet = server.connect() if server is not None else nnetClass(game)
+    if args.get('nnetCacheSize'):
+        nnet = CachedNNet(nnet, game, args.nnetCacheSize, args.get('hashKeys', False))
+    worker = dotdict({'game': game, 'nnet': nnet, 'args': args, 'version': version, 'loaded': 0,
+                      'remote': server is not None})
+
+
+def playSelfPlayEpisode(_):
+    """
+    Plays one episode in a SelfPlayWorkers process, loading the published
+    weights first if they changed since the last episode.
+
+    Returns:
+        trainExamples: the examples of executeEpisode
+        stats: the SearchStats of the episode (with args.collectStats)
+    """
+    version = worker.version.value
+    if version != worker.loaded:
+        if not worker.remote:
+            worker.nnet.load_checkpoint(folder=worker.args.checkpoint, filename=WEIGHTS_FILE)
+        elif isinstance(worker.nnet, CachedNNet):
+            # the server has loaded the weights, only the cached predictions are stale
+            worker.nnet.invalidate()
+        worker.loaded = version
+    mcts = MCTS(worker.game, worker.nnet, worker.args)
+    stats = SearchStats()
+    mcts.onStats = stats.merge
+    return executeEpisode(worker.game, mcts, worker.args), stats
+
+
+class SelfPlayWorkers():
+    """
+    A pool of self-play processes that lives across the iterations of
+    Coach.learn. Each process builds its network from nnetClass once; only
+    the weights move afterwards: publish saves them to WEIGHTS_FILE and bumps
+    a version number in shared memory, and every worker reloads the file
+    before its next episode once it sees the new version. Nothing else is
+    pickled per iteration, only the episode indices.
+
+    With args.inferenceServer, the workers hold no network at all: they
+    evaluate through RemoteNNet proxies of one InferenceServer process,
+    which batches the requests of all of them and loads the published
+    weights itself.
+    """
+
+    def __init__(self, game, nnetClass, args, processes):
+        self.args = args
+        self.version = mp.Value('i', 0)
+        self.server = None
+        if args.get('inferenceServer', False):
+            self.server = InferenceServer(game, nnetClass, processes, args)
+        self.pool = mp.Pool(processes=processes, initializer=initSelfPlayWorker,
+                            initargs=(game, nnetClass, args, self.version, self.server))
+
+    def publish(self, nnet):
+        """
+        Makes the workers play their next episodes with the weights of nnet.
+        Must not be called while games are being played.
+        """
+        nnet.save_checkpoint(folder=self.args.checkpoint, filename=WEIGHTS_FILE)
+        if self.server is not None:
+            self.server.load(self.args.checkpoint, WEIGHTS_FILE)
+        with self.version.get_lock():
+            self.version.value += 1
+
+    def playGames(self, numGames):
+        """
+        Returns:
+            results: an iterator over the (trainExamples, stats) of the
+                     numGames episodes, in the order they finish
+        """
+        return self.pool.imap_unordered(playSelfPlayEpisode, range(numGames))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        if self.server is not None:
+            self.server.close()
+
+
+class Episode():
+    """
+    The state of one game played by LockstepSelfPlay.
+    """
+
+    def __init__(self, game, nnet, args):
+        self.mcts = MCTS(game, nnet, args)
+        self.board = game.getInitBoard()
+        self.curPlayer = 1
+        self.episodeStep = 0
+        self.canonicalBoard = None
+        self.temp = 1
+        self.fullSearch = True  # whether the current move is recorded (see playoutCapFraction)
+        self.simsLeft = 0  # simulations still to run for the current move
+        self.trainExamples = []
+
+
+class LockstepSelfPlay():
+    """
+    Plays self-play games args.lockstepGames (default 16) at a time in a
+    single process. Every game has its own MCTS tree; in every round each
+    game that is still searching collects up to args.leafBatchSize leaves
+    (with virtual loss, see MCTS.collectLeaves), and the leaves of all the
+    games are evaluated together in one nnet.predict_batch call, boards
+    shared by several trees only once. The moves are chosen and the
+    examples recorded exactly as in Coach.executeEpisode, and args.earlyStop
+    skips forced moves and stops greedy searches once they are decided.
+
+    The search budget is args.numMCTSSims (numMCTSSimsFast for the fast
+    moves of playout cap randomization); time and node budgets are not
+    supported. Neither are gumbel root search, which is sequential by
+    nature, and root Dirichlet noise.
+    """
+
+    def __init__(self, game, nnet, args):
+        unsupported = [name for name in ('gumbel', 'searchTimeMs', 'maxNodesPerMove', 'rootDirichletAlpha')
+                       if args.get(name)]
+        if unsupported:
+            raise ValueError(f'Lockstep self-play does not support args.{", args.".join(unsupported)}')
+        if args.get('numMCTSSims') is None:
+            raise ValueError('Lockstep self-play requires args.numMCTSSims')
+        self.game = game
+        self.nnet = nnet
+        self.args = args
+        self.numGames = args.get('lockstepGames', 16)
+        self.leafBatchSize = args.get('leafBatchSize', 1)
+
+    def playGames(self, numGames):
+        """
+        Plays numGames games, at most args.lockstepGames of them at once.
+
+        Yields:
+            trainExamples: for every finished game, its examples in the format
+                           of Coach.executeEpisode
+        """
+        numStarted = 0
+        episodes = []
+        while episodes or numStarted < numGames:
+            while len(episodes) < self.numGames and numStarted < numGames:
+                episode = Episode(self.game, self.nnet, self.args)
+                self.startMove(episode)
+                episodes.append(episode)
+                numStarted += 1
+
+            self.searchRound(episodes)
+
+            for episode in [e for e in episodes if e.simsLeft <= 0]:
+                trainExamples = self.playMove(episode)
+                if trainExamples is not None:
+                    episodes.remove(episode)
+                    yield trainExamples
+
+    def startMove(self, episode):
+        """
+        Sets the search of the next move of episode up.
+        """
+        episode.episodeStep += 1
+        episode.temp = int(episode.episodeStep < self.args.tempThreshold)
+        episode.canonicalBoard = self.game.getCanonicalForm(episode.board, episode.curPlayer)
+        episode.mcts.advanceRoot(episode.canonicalBoard)
+
+        episode.fullSearch, numSims = moveBudget(self.args)
+        episode.simsLeft = self.args.numMCTSSims if numSims is None else numSims
+
+        if self.args.get('earlyStop', False) and np.sum(self.game.getValidMoves(episode.canonicalBoard, 1)) == 1:
+            # forced move, getActionProb will not search it
+            episode.simsLeft = 0
+
+    def searchRound(self, episodes):
+        """
+        Runs one round of simulations in every episode that is still
+        searching, with a single batched evaluation of all their leaves.
+        """
+        collected = []  # (episode, pending leaves)
+        boards = {}  # leaf s -> canonical board, over all the episodes
+        for episode in episodes:
+            if episode.simsLeft <= 0:
+                continue
+            pending, numSims = episode.mcts.collectLeaves(episode.canonicalBoard,
+                                                          min(self.leafBatchSize, episode.simsLeft))
+            episode.simsLeft -= numSims
+            collected.append((episode, pending))
+            for s, (board, _) in pending.items():
+                boards.setdefault(s, board)
+
+        if not boards:
+            return
+        pis, vs = self.nnet.predict_batch(list(boards.values()))
+        evaluations = dict(zip(boards, zip(pis, vs)))
+        for episode, pending in collected:
+            episode.mcts.expandLeaves(pending, [evaluations[s][0] for s in pending],
+                                      [evaluations[s][1] for s in pending])
+            if self.args.get('earlyStop', False) and episode.temp == 0 and self.decided(episode):
+                episode.mcts.simsSaved += episode.simsLeft
+                episode.simsLeft = 0
+
+    def decided(self, episode):
+        """
+        Returns:
+            decided: True if the most visited action of the current move of
+                     episode can no longer be overtaken in the simulations
+                     left (as with earlyStop in MCTS.runSimulations)
+        """
+        nsa = episode.mcts.Nsa.get(episode.mcts.boardKey(episode.canonicalBoard), ())
+        if len(nsa) < 2:
+            return False
+        second, first = np.partition(nsa, -2)[-2:]
+        return first - second > episode.simsLeft
+
+    def playMove(self, episode):
+        """
+        Plays the move of episode whose search is done and sets the next one
+        up.
+
+        Returns:
+            trainExamples: the examples of the game if it has ended, else None
+        """
+        pi = episode.mcts.getActionProb(episode.canonicalBoard, temp=episode.temp, numSims=0)
+        if episode.fullSearch:
+            recordMove(self.game, episode.trainExamples, episode.canonicalBoard, episode.curPlayer, pi)
+
+        action = chooseAction(episode.mcts, pi, self.args)
+        episode.board, episode.curPlayer = self.game.getNextState(episode.board, episode.curPlayer, action)
+
+        trainExamples = gameResult(self.game, episode.board, episode.curPlayer, episode.trainExamples)
+        if trainExamples is None:
+            self.startMove(episode)
+        return trainExamples
+
+
+class AsyncSelfPlay():
+    """
+    Plays self-play games as coroutines on one asyncio event loop, up to
+    args.lockstepGames (default 16) at a time; Coach.learn uses it with
+    args.asyncSelfPlay. Each game searches with its own AsyncMCTS, and all
+    of them await the same BatchEvaluator, which evaluates up to
+    args.evaluatorBatchSize (default 32) boards per forward pass or
+    whatever is queued after args.evaluatorTimeoutMs (default 1). The moves
+    are chosen and the examples recorded exactly as in
+    Coach.executeEpisode.
+    """
+
+    def __init__(self, game, nnet, args):
+        self.game = game
+        self.nnet = nnet
+        self.args = args
+        self.numGames = args.get('lockstepGames') or 16
+        self.evaluator = None
+
+    def playGames(self, numGames):
+        """
+        Returns:
+            results: the examples of every one of the numGames games, in the
+                     format of Coach.executeEpisode
+        """
+        return asyncio.run(self.playGamesAsync(numGames))
+
+    async def playGamesAsync(self, numGames):
+        self.evaluator = BatchEvaluator(self.nnet, self.args.get('evaluatorBatchSize', 32),
+                                        self.args.get('evaluatorTimeoutMs', 1))
+        slots = asyncio.Semaphore(self.numGames)
+
+        async def playGame():
+            async with slots:
+                return await self.executeEpisode(AsyncMCTS(self.game, self.evaluator, self.args))
+
+        return await asyncio.gather(*[playGame() for _ in range(numGames)])
+
+    async def executeEpisode(self, mcts):
+        """
+        The coroutine version of executeEpisode.
+        """
+        trainExamples = []
+        board = self.game.getInitBoard()
+        curPlayer = 1
+        episodeStep = 0
+
+        while True:
+            episodeStep += 1
+            canonicalBoard = self.game.getCanonicalForm(board, curPlayer)
+            temp = int(episodeStep < self.args.tempThreshold)
+            mcts.advanceRoot(canonicalBoard)
+            fullSearch, numSims = moveBudget(self.args)
+
+            pi = await mcts.getActionProb(canonicalBoard, temp=temp, numSims=numSims)
+            if fullSearch:
+                recordMove(self.game, trainExamples, canonicalBoard, curPlayer, pi)
+
+            action = chooseAction(mcts, pi, self.args)
+            board, curPlayer = self.game.getNextState(board, curPlayer, action)
+
+            examples = gameResult(self.game, board, curPlayer, trainExamples)
+            if examples is not None:
+                return examples
@@ -0,0 +1,195 @@
+import tempfile
+import time
+import zlib
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from Arena import Arena
+from Coach import Coach
+from InferenceServer import InferenceServer
+from MCTS import MCTS, MCTSPlayer
+from NeuralNet import NeuralNet
+from ParallelMCTS import RootParallelMCTS
+from SelfPlay import LockstepSelfPlay, SelfPlayWorkers
+from othello.OthelloGame import OthelloGame
+from tafl.TaflGame import TaflGame
+from utils import *
+
+"""
+use this script to measure search throughput. The network is replaced by a
+uniform policy so that the numbers reflect the cost of MCTS and game logic
+only; swap in a real NNetWrapper to include inference.
+"""
+
+
+class UniformNNet(NeuralNet):
+    """
+    A stand-in network returning a uniform policy and a neutral value.
+    """
+
+    def __init__(self, game):
+        self.action_size = game.getActionSize()
+
+    def predict(self, board):
+        return np.ones(self.action_size) / self.action_size, 0
+
+    def predict_batch(self, boards):
+        return np.ones((len(boards), self.action_size)) / self.action_size, np.zeros(len(boards))
+
+
+class HashedNNet(NeuralNet):
+    """
+    A stand-in network with non-uniform but meaningless priors and value: a
+    hash of the board. Unlike UniformNNet, the order of the priors differs
+    from board to board, so the actions a search favours are not simply the
+    lowest action indices.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.action_size = game.getActionSize()
+
+    def predict(self, board):
+        key = self.game.stringRepresentation(board)
+        rng = np.random.RandomState(zlib.crc32(key if isinstance(key, bytes) else key.encode()))
+        pi = rng.rand(self.action_size)
+        return pi / pi.sum(), rng.rand() * 2 - 1
+
+
+def simsPerSecond(game, nnet, args, moves=10, mcts=None):
+    """
+    Plays the first moves of a game with MCTS (or the given mcts) and returns
+    the number of simulations run per second of wall-clock time.
+    """
+    mcts = mcts or MCTS(game, nnet, args)
+    board, curPlayer = game.getInitBoard(), 1
+    sims = 0
+    start = time.time()
+    for _ in range(moves):
+        canonicalBoard = game.getCanonicalForm(board, curPlayer)
+        action = np.argmax(mcts.getActionProb(canonicalBoard, temp=0))
+        sims += mcts.lastSearchSims
+        board, curPlayer = game.getNextState(board, curPlayer, action)
+        if game.getGameEnded(board, curPlayer) != 0:
+            break
+    return sims / (time.time() - start)
+
+
+def wideningVersusPlain(game, nnet, args, games=4):
+    """
+    Pits MCTS with progressive widening against plain MCTS in Arena, both
+    searching for the same time per move (args.searchTimeMs). The result
+    only says something about playing strength with a trained nnet; with a
+    stand-in network it compares the searches on the same (arbitrary)
+    priors.
+
+    Returns:
+        wideningWins, plainWins, draws
+    """
+    widening = MCTSPlayer(MCTS(game, nnet, dotdict(dict(args, progressiveWidening=True))))
+    plain = MCTSPlayer(MCTS(game, nnet, args))
+    return Arena(widening, plain, game).playGames(games)
+
+
+def selfPlayGamesPerSecond(game, nnet, args, games=32):
+    """
+    Plays games self-play games with the Pool of Coach.learn and with
+    LockstepSelfPlay (args.lockstepGames at a time in this process).
+
+    Returns:
+        poolRate, lockstepRate: games per second of both
+    """
+    coach = Coach(game, nnet, args)
+    start = time.time()
+    with Pool(processes=max(1, cpu_count() // 2)) as pool:
+        list(pool.imap_unordered(coach._executeEpisodeWrapper, range(games)))
+    poolRate = games / (time.time() - start)
+
+    start = time.time()
+    list(LockstepSelfPlay(game, nnet, args).playGames(games))
+    lockstepRate = games / (time.time() - start)
+    return poolRate, lockstepRate
+
+
+def inferenceServerVersusLocal(game, nnetClass, args, games=16, processes=4, predictions=500):
+    """
+    Compares self-play with a network in every worker process to self-play
+    through one InferenceServer (args.inferenceServer).
+
+    Returns:
+        localRate, serverRate: self-play games per second of both
+        localLatency, serverLatency: mean time of one predict call in
+                                     milliseconds, locally and through a
+                                     RemoteNNet of an otherwise idle server
+    """
+    nnet = nnetClass(game)
+    rates = []
+    with tempfile.TemporaryDirectory() as folder:
+        for inferenceServer in (False, True):
+            workers = SelfPlayWorkers(game, nnetClass, dotdict(dict(args, checkpoint=folder,
+                                                                     inferenceServer=inferenceServer)), processes)
+            workers.publish(nnet)
+            start = time.time()
+            list(workers.playGames(games))
+            rates.append(games / (time.time() - start))
+            workers.close()
+
+    board = game.getInitBoard()
+    start = time.time()
+    for _ in range(predictions):
+        nnet.predict(board)
+    localLatency = (time.time() - start) * 1000 / predictions
+
+    server = InferenceServer(game, nnetClass, 1, args)
+    remote = server.connect()
+    remote.predict(board)  # waits for the server to be up
+    start = time.time()
+    for _ in range(predictions):
+        remote.predict(board)
+    serverLatency = (time.time() - start) * 1000 / predictions
+    server.close()
+    return rates[0], rates[1], localLatency, serverLatency
+
+
+def loadNNet(game):
+    """
+    Returns the pytorch Othello network if torch is installed (so that
+    batching pays off), else the uniform stand-in.
+    """
+    try:
+        from othello.pytorch.NNet import NNetWrapper
+    except ImportError:
+        return UniformNNet(game)
+    return NNetWrapper(game)
+
+
+if __name__ == "__main__":
+    args = dotdict({'numMCTSSims': 200, 'cpuct': 1.0})
+    for name, g in [('Othello 8x8', OthelloGame(8)), ('Tafl Brandubh', TaflGame("Brandubh"))]:
+        print(f'{name}: {simsPerSecond(g, UniformNNet(g), args):.0f} sims/sec')
+
+    # there is no trained Tafl model: with hashed priors the widened set is at least not the lowest action
+    # indices, but the result is no measure of playing strength
+    args = dotdict({'searchTimeMs': 100, 'cpuct': 1.0, 'clearTreeBetweenGames': True})
+    g = TaflGame("Brandubh")
+    print('Tafl Brandubh, widening vs plain at %d ms/move with hashed priors, no trained model available '
+          '(wins, losses, draws): %s' % (args.searchTimeMs, wideningVersusPlain(g, HashedNNet(g), args)))
+
+    args = dotdict({'numMCTSSims': 200, 'cpuct': 1.0, 'rootDirichletAlpha': 0.3})
+    g = OthelloGame(8)
+    for numProcesses in (1, 2, 4):
+        args.numProcesses = numProcesses
+        mcts = RootParallelMCTS(g, UniformNNet(g), args)
+        print(f'Othello 8x8, root parallel on {numProcesses} processes: '
+              f'{simsPerSecond(g, None, args, mcts=mcts):.0f} sims/sec')
+        mcts.close()
+
+    args = dotdict({'numMCTSSims': 25, 'cpuct': 1.0, 'tempThreshold': 15, 'leafBatchSize': 8, 'lockstepGames': 16})
+    g = OthelloGame(6)
+    nnet = loadNNet(g)
+    print('Othello 6x6 self-play with %s, Pool vs lockstep: %.2f vs %.2f games/sec'
+          % ((type(nnet).__name__,) + selfPlayGamesPerSecond(g, nnet, args)))
+
+    print('Othello 6x6 self-play with %s, per-worker nets vs inference server: %.2f vs %.2f games/sec, '
+          'predict latency %.2f vs %.2f ms' % ((type(nnet).__name__,) + inferenceServerVersusLocal(g, type(nnet), args)))
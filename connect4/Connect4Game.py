@@ -3,6 +3,7 @@ import numpy as np
 
 sys.path.append('..')
 from Game import Game
+from utils import ZobristHash
 from .Connect4Logic import Board
 
 
@@ -14,6 +15,7 @@ class Connect4Game(Game):
     def __init__(self, height=None, width=None, win_length=None, np_pieces=None):
         Game.__init__(self)
         self._base_board = Board(height, width, win_length, np_pieces)
+        self.zobrist = ZobristHash(self.getBoardSize())
 
     def getInitBoard(self):
         return self._base_board.np_pieces
@@ -62,6 +64,9 @@ class Connect4Game(Game):
     def stringRepresentation(self, board):
         return board.tostring()
 
+    def hashKey(self, board):
+        return self.zobrist.hash(board)
+
     @staticmethod
     def display(board):
         print(" -----------------------")
@@ -1,11 +1,13 @@
+import asyncio
 import os
 import sys
+import threading
 import numpy as np
 from flask import Flask, request, Response
 
 sys.path.append("..")
 
-from MCTS import MCTS
+from AsyncMCTS import AsyncMCTS, BatchEvaluator
 
 from dotsandboxes.DotsAndBoxesGame import DotsAndBoxesGame
 from dotsandboxes.keras.NNet import NNetWrapper
@@ -16,6 +18,8 @@ app = Flask(__name__)
 
 mcts = None
 g = None
+# all requests search on one event loop, so their leaves share batched forward passes
+loop = asyncio.new_event_loop()
 
 
 # curl -d "board=0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0" -X POST http://localhost:8888/predict
@@ -25,7 +29,8 @@ def predict():
 
     use_alpha_zero = True
     if use_alpha_zero:
-        action = np.argmax(mcts.getActionProb(board, temp=0))
+        probs = asyncio.run_coroutine_threadsafe(mcts.getActionProb(board, temp=0), loop).result()
+        action = np.argmax(probs)
     else:
         action = GreedyRandomPlayer(g).play(board)
 
@@ -39,6 +44,9 @@ def predict():
 if __name__ == '__main__':
     g = DotsAndBoxesGame(n=3)
     n1 = NNetWrapper(g)
-    mcts = MCTS(g, n1, dotdict({'numMCTSSims': 50, 'cpuct': 1.0}))
+    # search for a fixed time per request rather than a fixed number of simulations
+    evaluator = BatchEvaluator(n1, maxBatchSize=32, timeoutMs=2)
+    mcts = AsyncMCTS(g, evaluator, dotdict({'searchTimeMs': 200, 'minMCTSSims': 10, 'cpuct': 1.0, 'leafBatchSize': 8}))
     n1.load_checkpoint(os.path.join('..', 'pretrained_models', 'dotsandboxes', 'keras', '3x3'), 'best.pth.tar')
+    threading.Thread(target=loop.run_forever, daemon=True).start()
     app.run(debug=False, host='0.0.0.0', port=8888)
@@ -2,7 +2,7 @@ import numpy as np
 import sys
 import os
 sys.path.append('..')
-from utils import dotdict
+from utils import dotdict, exampleArrays
 from NeuralNet import NeuralNet
 
 from .DotsAndBoxesNNet import DotsAndBoxesNNet as onnet
@@ -42,15 +42,12 @@ class NNetWrapper(NeuralNet):
 
     def train(self, examples):
         """
-        examples: list of examples, each example is of form (board, pi, v)
+        examples: list of examples, each example is of form (board, pi, v), or a ReplayBuffer
         """
-        input_boards, target_pis, target_vs = list(zip(*examples))
-        input_boards = np.asarray(input_boards)
+        input_boards, target_pis, target_vs = exampleArrays(examples)
 
         normalize_score(input_boards)
 
-        target_pis = np.asarray(target_pis)
-        target_vs = np.asarray(target_vs)
         self.nnet.model.fit(x=input_boards, y=[target_pis, target_vs], batch_size=args.batch_size, epochs=args.epochs)
 
     def predict(self, board):
@@ -66,6 +63,16 @@ class NNetWrapper(NeuralNet):
 
         return pi[0], v[0]
 
+    def predict_batch(self, boards):
+        """
+        boards: list of np arrays with boards, evaluated in one forward pass
+        """
+        boards = np.array(boards)  # a copy, normalized in place
+        normalize_score(boards)
+
+        pi, v = self.nnet.model.predict(boards, verbose=False)
+        return pi, v.reshape(-1)
+
     def save_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
         # change extension
         filename = filename.split(".")[0] + ".h5"
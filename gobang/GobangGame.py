@@ -2,6 +2,7 @@ from __future__ import print_function
 import sys
 sys.path.append('..')
 from Game import Game
+from utils import ZobristHash
 from .GobangLogic import Board
 import numpy as np
 
@@ -10,6 +11,7 @@ class GobangGame(Game):
     def __init__(self, n=15, nir=5):
         self.n = n
         self.n_in_row = nir
+        self.zobrist = ZobristHash((n, n))
 
     def getInitBoard(self):
         # return initial board (numpy board)
@@ -100,6 +102,9 @@ class GobangGame(Game):
         # 8x8 numpy array (canonical board)
         return board.tostring()
 
+    def hashKey(self, board):
+        return self.zobrist.hash(board)
+
     @staticmethod
     def display(board):
         n = board.shape[0]
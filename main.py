@@ -20,6 +20,22 @@ args = dotdict({
     'numMCTSSims': 25,          # Number of games moves for MCTS to simulate.
     'arenaCompare': 40,         # Number of games to play during arena play to determine if new net will be accepted.
     'cpuct': 1,
+    'leafBatchSize': 1,         # MCTS leaves evaluated together in one batched forward pass (virtual loss); 8 suits batching (GPU) networks.
+    'maxTreeNodes': 500000,     # MCTS evicts least recently visited boards beyond this many (None for no limit).
+    'hashKeys': False,          # Index MCTS trees and the nnet cache by 64-bit Zobrist keys (less memory, slower per board).
+    'clearTreeBetweenGames': False,  # Whether arena players start every game with an empty MCTS tree.
+    'earlyStop': True,          # Stop greedy (temp=0) searches once the best move can no longer change.
+    'nnetCacheSize': 100000,    # Number of network predictions kept in the shared LRU cache (0 to disable).
+    'gumbel': False,            # Gumbel top-k root search with sequential halving, for small numMCTSSims.
+    'playoutCapFraction': None, # Fraction of self-play moves searched fully and kept as examples (None: all).
+    'numMCTSSimsFast': 5,       # Simulations of the other moves when playoutCapFraction is set.
+    'collectStats': False,      # Log per-iteration MCTS stats: sims/sec, depth, nnet/game/tree time split.
+    'inferenceServer': False,   # Self-play workers share one batching inference process instead of holding a net each.
+    'pipeline': False,          # Run self-play, training and gating concurrently (Coach.learnAsync).
+    'selfPlayProcesses': 4,     # Self-play processes of the pipeline.
+    'replayBuffer': False,      # Keep the training examples in preallocated arrays (ReplayBuffer) instead of lists of tuples, saved as .npy shards.
+    'asyncSelfPlay': False,     # Play lockstepGames (default 16) self-play games as coroutines sharing one batching evaluator.
+    'lockstepGames': None,      # Play this many self-play games at once in one process, batching leaves across games (None: Pool).
 
     'checkpoint': './temp/',
     'load_model': False,
@@ -50,7 +66,10 @@ def main():
         c.loadTrainExamples()
 
     log.info('Starting the learning process 🎉')
-    c.learn()
+    if args.pipeline:
+        c.learnAsync()
+    else:
+        c.learn()
 
 
 if __name__ == "__main__":
@@ -2,6 +2,7 @@ from __future__ import print_function
 import sys
 sys.path.append('..')
 from Game import Game
+from utils import ZobristHash
 from .OthelloLogic import Board
 import numpy as np
 
@@ -18,6 +19,7 @@ class OthelloGame(Game):
 
     def __init__(self, n):
         self.n = n
+        self.zobrist = ZobristHash((n, n))
 
     def getInitBoard(self):
         # return initial board (numpy board)
@@ -92,6 +94,9 @@ class OthelloGame(Game):
     def stringRepresentation(self, board):
         return board.tostring()
 
+    def hashKey(self, board):
+        return self.zobrist.hash(board)
+
     def stringRepresentationReadable(self, board):
         board_s = "".join(self.square_content[square] for row in board for square in row)
         return board_s
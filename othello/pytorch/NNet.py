@@ -46,7 +46,8 @@ class NNetWrapper(NeuralNet):
 
     def train(self, examples):
         """
-        examples: list of examples, each example is of form (board, pi, v)
+        examples: list of examples, each example is of form (board, pi, v), or
+                  a ReplayBuffer to sample the batches from
         """
         optimizer = optim.Adam(self.nnet.parameters())
 
@@ -60,11 +61,15 @@ class NNetWrapper(NeuralNet):
 
             t = tqdm(range(batch_count), desc="Training Net")
             for _ in t:
-                sample_ids = np.random.randint(len(examples), size=args.batch_size)
-                boards, pis, vs = list(zip(*[examples[i] for i in sample_ids]))
-                boards = torch.FloatTensor(np.array(boards).astype(np.float64))
-                target_pis = torch.FloatTensor(np.array(pis))
-                target_vs = torch.FloatTensor(np.array(vs).astype(np.float64))
+                if hasattr(examples, 'sample'):
+                    boards, pis, vs = examples.sample(args.batch_size)
+                    boards, target_pis, target_vs = torch.from_numpy(boards), torch.from_numpy(pis), torch.from_numpy(vs)
+                else:
+                    sample_ids = np.random.randint(len(examples), size=args.batch_size)
+                    boards, pis, vs = list(zip(*[examples[i] for i in sample_ids]))
+                    boards = torch.FloatTensor(np.array(boards).astype(np.float64))
+                    target_pis = torch.FloatTensor(np.array(pis))
+                    target_vs = torch.FloatTensor(np.array(vs).astype(np.float64))
 
                 # predict
                 boards, target_pis, target_vs = (
@@ -107,6 +112,19 @@ class NNetWrapper(NeuralNet):
         # print('PREDICTION TIME TAKEN : {0:03f}'.format(time.time()-start))
         return torch.exp(pi).data.cpu().numpy()[0], v.data.cpu().numpy()[0]
 
+    def predict_batch(self, boards):
+        """
+        boards: list of np arrays with boards, evaluated in one forward pass
+        """
+        boards = torch.FloatTensor(np.array(boards).astype(np.float64))
+        boards = boards.contiguous().to(args.device)
+        boards = boards.view(-1, self.board_x, self.board_y)
+        self.nnet.eval()
+        with torch.no_grad():
+            pi, v = self.nnet(boards)
+
+        return torch.exp(pi).data.cpu().numpy(), v.data.cpu().numpy().reshape(-1)
+
     def loss_pi(self, targets, outputs):
         return -torch.sum(targets * outputs) / targets.size()[0]
 
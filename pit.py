@@ -1,5 +1,6 @@
 import Arena
-from MCTS import MCTS
+from MCTS import MCTS, MCTSPlayer
+from ParallelMCTS import ThreadedMCTS
 from othello.OthelloGame import OthelloGame
 from othello.OthelloPlayers import *
 from othello.pytorch.NNet import NNetWrapper as NNet
@@ -34,18 +35,18 @@ if mini_othello:
     n1.load_checkpoint('./pretrained_models/othello/pytorch/','6x100x25_best.pth.tar')
 else:
     n1.load_checkpoint('./pretrained_models/othello/pytorch/','8x8_100checkpoints_best.pth.tar')
-args1 = dotdict({'numMCTSSims': 50, 'cpuct':1.0})
-mcts1 = MCTS(g, n1, args1)
-n1p = lambda x: np.argmax(mcts1.getActionProb(x, temp=0))
+args1 = dotdict({'numMCTSSims': 50, 'cpuct':1.0, 'numThreads': 4})
+mcts1 = ThreadedMCTS(g, n1, args1)  # searches one game on several threads
+n1p = MCTSPlayer(mcts1)
 
 if human_vs_cpu:
     player2 = hp
 else:
     n2 = NNet(g)
     n2.load_checkpoint('./pretrained_models/othello/pytorch/', '8x8_100checkpoints_best.pth.tar')
-    args2 = dotdict({'numMCTSSims': 50, 'cpuct': 1.0})
-    mcts2 = MCTS(g, n2, args2)
-    n2p = lambda x: np.argmax(mcts2.getActionProb(x, temp=0))
+    args2 = dotdict({'numMCTSSims': 50, 'cpuct': 1.0, 'numThreads': 4})
+    mcts2 = ThreadedMCTS(g, n2, args2)
+    n2p = MCTSPlayer(mcts2)
 
     player2 = n2p  # Player 2 is neural network if it's cpu vs cpu.
 
@@ -5,6 +5,7 @@ import numpy as np
 
 sys.path.append('../..')
 from NeuralNet import NeuralNet
+from utils import exampleArrays
 from rts.keras.RTSNNet import RTSNNet
 from rts.src.config import VERBOSE_MODEL_FIT
 
@@ -39,14 +40,11 @@ class NNetWrapper(NeuralNet):
     def train(self, examples):
         """
         Encodes examples using one of 2 encoders and starts fitting.
-        :param examples: list of examples, each example is of form (board, pi, v)
+        :param examples: list of examples, each example is of form (board, pi, v), or a ReplayBuffer
         """
         from rts.src.config_class import CONFIG
 
-        input_boards, target_pis, target_vs = list(zip(*examples))
-        input_boards = np.asarray(input_boards)
-        target_pis = np.asarray(target_pis)
-        target_vs = np.asarray(target_vs)
+        input_boards, target_pis, target_vs = exampleArrays(examples)
 
         """
         input_boards = CONFIG.nnet_args.encoder.encode_multiple(input_boards)
@@ -0,0 +1,640 @@
+"""
+To run tests:
+pytest test_mcts.py
+"""
+
+import itertools
+import os
+import time
+import zlib
+
+import numpy as np
+import pytest
+
+from Arena import Arena
+from CachedNNet import CachedNNet
+from MCTS import MCTS, MCTSPlayer, SearchStats
+from NeuralNet import NeuralNet
+from gobang.GobangGame import GobangGame
+from othello.OthelloGame import OthelloGame
+from tictactoe.TicTacToeGame import TicTacToeGame
+from tictactoe.TicTacToePlayers import RandomPlayer
+from utils import *
+
+
+class HashedNNet(NeuralNet):
+    """A deterministic stand-in network: priors and value are a hash of the board."""
+
+    def __init__(self, game):
+        self.action_size = game.getActionSize()
+
+    def predict(self, board):
+        rng = np.random.RandomState(zlib.crc32(board.tobytes()))
+        pi = rng.rand(self.action_size)
+        return pi / pi.sum(), rng.rand() * 2 - 1
+
+
+class RecursiveMCTS(MCTS):
+    """The original recursive search, kept as a reference for the iterative one."""
+
+    def search(self, canonicalBoard):
+        s = self.boardKey(canonicalBoard)
+        if s not in self.Es:
+            self.Es[s] = self.game.getGameEnded(canonicalBoard, 1)
+        if self.Es[s] != 0:
+            return -self.Es[s]
+
+        if s not in self.Ps:
+            pi, v = self.nnet.predict(canonicalBoard)
+            self.expand(s, canonicalBoard, pi)
+            return -v
+
+        i = self.selectAction(s)
+        next_s, next_player = self.game.getNextState(canonicalBoard, 1, self.As[s][i])
+        v = self.search(self.game.getCanonicalForm(next_s, next_player))
+
+        self.Qsa[s][i] = (self.Nsa[s][i] * self.Qsa[s][i] + v) / (self.Nsa[s][i] + 1)
+        self.Nsa[s][i] += 1
+        self.Ns[s] += 1
+        return -v
+
+
+def make_mcts(**kwargs):
+    game = TicTacToeGame()
+    args = dotdict({'numMCTSSims': 50, 'cpuct': 1.0})
+    args.update(kwargs)
+    return game, MCTS(game, HashedNNet(game), args)
+
+
+def test_action_prob_covers_valid_moves_only():
+    game, mcts = make_mcts()
+    board, _ = game.getNextState(game.getInitBoard(), 1, 4)
+    board = game.getCanonicalForm(board, -1)
+    probs = mcts.getActionProb(board, temp=1)
+    valids = game.getValidMoves(board, 1)
+    assert abs(sum(probs) - 1) < 1e-6
+    assert all(p == 0 for p, v in zip(probs, valids) if not v)
+
+
+def test_root_visits_match_simulations():
+    game, mcts = make_mcts()
+    board = game.getInitBoard()
+    mcts.getActionProb(board, temp=1)
+    s = game.stringRepresentation(board)
+    # the first simulation only expands the root
+    assert mcts.Nsa[s].sum() == mcts.Ns[s] == 49
+
+
+def test_batched_search_removes_virtual_loss():
+    game, mcts = make_mcts(leafBatchSize=8)
+    board = game.getInitBoard()
+    mcts.getActionProb(board, temp=1)
+    s = game.stringRepresentation(board)
+    assert mcts.Nsa[s].sum() == mcts.Ns[s] == 49
+    for s in mcts.Ns:
+        assert mcts.Nsa[s].sum() == mcts.Ns[s]
+        assert np.all(np.abs(mcts.Qsa[s]) <= 1 + 1e-9)
+
+
+def test_iterative_search_matches_recursive():
+    game = TicTacToeGame()
+    args = dotdict({'numMCTSSims': 100, 'cpuct': 1.0})
+    mctss = [MCTS(game, HashedNNet(game), args), RecursiveMCTS(game, HashedNNet(game), args)]
+    boards = [game.getInitBoard()] * 2
+    for _ in range(5):
+        actions = []
+        for i, mcts in enumerate(mctss):
+            np.random.seed(0)
+            actions.append(int(np.argmax(mcts.getActionProb(boards[i], temp=0))))
+            boards[i] = game.getCanonicalForm(game.getNextState(boards[i], 1, actions[i])[0], -1)
+        assert actions[0] == actions[1]
+        assert mctss[0].Nsa.keys() == mctss[1].Nsa.keys()
+        for s in mctss[0].Nsa:
+            assert np.array_equal(mctss[0].Nsa[s], mctss[1].Nsa[s])
+
+
+def test_advance_root_keeps_played_subtree_only():
+    game, mcts = make_mcts(numMCTSSims=200)
+    board = game.getInitBoard()
+    mcts.getActionProb(board, temp=1)
+    root = game.stringRepresentation(board)
+    i = int(np.argmax(mcts.Nsa[root]))
+    action = mcts.As[root][i]
+    child = mcts.Cs[root][i]
+    childVisits = mcts.Nsa[child].copy()
+    numNodes = len(mcts.Es)
+
+    childBoard = game.getCanonicalForm(game.getNextState(board, 1, action)[0], -1)
+    numFreed = mcts.advanceRoot(childBoard)
+    assert numFreed > 0 and len(mcts.Es) == numNodes - numFreed
+    assert root not in mcts.Es
+    assert np.array_equal(mcts.Nsa[child], childVisits)
+    for s in mcts.Cs:
+        assert all(c in mcts.Es for c in mcts.Cs[s].values())
+
+
+def test_arena_advances_mcts_player_roots():
+    game, mcts = make_mcts()
+    arena = Arena(MCTSPlayer(mcts), RandomPlayer(game).play, game)
+    arena.playGames(2)
+
+
+def test_tree_stays_within_node_budget():
+    for policy in ('lru', 'visits'):
+        game, mcts = make_mcts(numMCTSSims=300, maxTreeNodes=60, evictionPolicy=policy)
+        board = game.getInitBoard()
+        probs = mcts.getActionProb(board, temp=1)
+        assert len(mcts.Es) <= 60 and mcts.numEvicted > 0
+        assert game.stringRepresentation(board) in mcts.Ns
+        assert abs(sum(probs) - 1) < 1e-6
+
+
+def test_tree_stays_within_byte_budget():
+    game, mcts = make_mcts(numMCTSSims=300, maxTreeBytes=50000)
+    mcts.getActionProb(game.getInitBoard(), temp=1)
+    assert 0 < mcts.treeBytes <= 50000 and mcts.numEvicted > 0
+    assert mcts.treeBytes == sum(mcts.nodeBytes(s) for s in mcts.Es)
+
+
+def test_zobrist_keys_do_not_collide():
+    game = TicTacToeGame()
+    boards = itertools.product((-1, 0, 1), repeat=9)
+    keys = {game.hashKey(np.array(b).reshape(3, 3)) for b in boards}
+    assert len(keys) == 3 ** 9
+
+    game = OthelloGame(8)
+    rng = np.random.RandomState(0)
+    boards = {rng.randint(-1, 2, size=(8, 8)).tobytes() for _ in range(20000)}
+    keys = {game.hashKey(np.frombuffer(b, dtype=int).reshape(8, 8)) for b in boards}
+    assert len(keys) == len(boards)
+
+    # the tree only uses them with args.hashKeys
+    game, mcts = make_mcts(hashKeys=True)
+    mcts.getActionProb(game.getInitBoard())
+    assert all(isinstance(s, int) for s in mcts.Ns)
+    game, mcts = make_mcts()
+    mcts.getActionProb(game.getInitBoard())
+    assert all(isinstance(s, bytes) for s in mcts.Ns)
+
+
+def test_symmetric_tree_shares_evaluations():
+    numPredicts = []
+    for symmetricTree in (False, True):
+        game, mcts = make_mcts(numMCTSSims=400, symmetricTree=symmetricTree)
+        predict = mcts.nnet.predict
+        calls = []
+        mcts.nnet.predict = lambda board: calls.append(board) or predict(board)
+        mcts.getActionProb(game.getInitBoard(), temp=1)
+        numPredicts.append(len(calls))
+    assert numPredicts[1] < 0.9 * numPredicts[0]
+
+
+def test_symmetric_tree_policy_orientation():
+    game, mcts = make_mcts(symmetricTree=True)
+    board, player = game.getInitBoard(), 1
+    for action in (0, 5):  # a position without symmetries of its own
+        board, player = game.getNextState(board, player, action)
+    board = game.getCanonicalForm(board, player)
+    probs = mcts.getActionProb(board, temp=1)
+    valids = game.getValidMoves(board, 1)
+    assert abs(sum(probs) - 1) < 1e-6
+    assert all(p == 0 for p, v in zip(probs, valids) if not v)
+
+
+def test_cached_nnet_is_shared_and_invalidated():
+    game = TicTacToeGame()
+    nnet = CachedNNet(HashedNNet(game), game, maxSize=1000)
+    args = dotdict({'numMCTSSims': 50, 'cpuct': 1.0})
+    board = game.getInitBoard()
+    MCTS(game, nnet, args).getActionProb(board)
+    misses = nnet.misses
+    MCTS(game, nnet, args).getActionProb(board)
+    assert nnet.misses == misses and nnet.stats().hitRate >= 0.5
+
+    pis, vs = nnet.predict_batch([board, board])
+    assert np.array_equal(pis[0], nnet.predict(board)[0]) and vs.shape == (2,)
+
+    nnet.train([])
+    assert nnet.stats().entries == 0 and nnet.cacheBytes == 0
+
+
+def test_search_budgets():
+    game, mcts = make_mcts(numMCTSSims=None, searchTimeMs=50)
+    start = time.time()
+    mcts.getActionProb(game.getInitBoard())
+    assert time.time() - start < 1 and mcts.lastSearchSims > 0
+
+    game, mcts = make_mcts(numMCTSSims=None, maxNodesPerMove=10)
+    mcts.getActionProb(game.getInitBoard())
+    assert mcts.numExpanded == 10
+
+    game, mcts = make_mcts(numMCTSSims=None, searchTimeMs=0, minMCTSSims=20, leafBatchSize=8)
+    mcts.getActionProb(game.getInitBoard())
+    assert mcts.lastSearchSims >= 20
+
+
+class SlowNNet(HashedNNet):
+    """A HashedNNet taking 10 ms per prediction, longer than the time budgets below."""
+
+    def predict(self, board):
+        time.sleep(0.01)
+        return super().predict(board)
+
+
+def test_budgets_shorter_than_an_evaluation_still_visit_the_root():
+    game = TicTacToeGame()
+    board = np.array([[1, -1, 1], [-1, 1, -1], [-1, 0, 0]])  # two legal moves
+    valids = game.getValidMoves(board, 1)
+    for budget in ({'searchTimeMs': 5}, {'maxNodesPerMove': 1}):
+        args = dotdict({'numMCTSSims': None, 'cpuct': 1.0})
+        args.update(budget)
+        mcts = MCTS(game, SlowNNet(game), args)
+        probs = mcts.getActionProb(board, temp=1)
+        assert np.all(np.isfinite(probs)) and all(p == 0 for p, v in zip(probs, valids) if not v)
+        assert mcts.lastSearchSims >= 2
+        for _ in range(10):
+            mcts = MCTS(game, SlowNNet(game), args)
+            assert valids[int(np.argmax(mcts.getActionProb(board, temp=0)))]
+
+    # a single simulation never visits the root, the masked priors are played
+    mcts = MCTS(game, HashedNNet(game), dotdict({'numMCTSSims': 1, 'cpuct': 1.0}))
+    probs = mcts.getActionProb(board, temp=1)
+    s = game.stringRepresentation(board)
+    assert mcts.lastSearchSims == 1 and np.allclose(np.array(probs)[mcts.As[s]], mcts.Ps[s])
+    assert np.isclose(sum(probs), 1) and all(p == 0 for p, v in zip(probs, valids) if not v)
+
+
+def test_early_stop():
+    game, mcts = make_mcts(numMCTSSims=200, earlyStop=True)
+    _, fullMcts = make_mcts(numMCTSSims=200)
+    board = game.getInitBoard()
+    probs = mcts.getActionProb(board, temp=0)
+    assert mcts.lastSearchSims < 200 and mcts.simsSaved == 200 - mcts.lastSearchSims
+    assert np.argmax(probs) == np.argmax(fullMcts.getActionProb(board, temp=0))
+
+    forced = np.array([[1, -1, 1], [1, -1, -1], [-1, 1, 0]])
+    probs = mcts.getActionProb(forced, temp=0)
+    assert probs[8] == 1 and mcts.lastSearchSims == 0
+
+
+def test_solver_proves_wins_and_losses():
+    game, mcts = make_mcts(numMCTSSims=400, mctsSolver=True)
+    win = np.array([[1, 1, 0], [-1, -1, 0], [0, 0, 0]])
+    probs = mcts.getActionProb(win, temp=1)
+    assert probs[2] == 1 and mcts.Ss[game.stringRepresentation(win)] == 1
+    assert mcts.lastSearchSims < 400
+
+    # the opponent threatens both the top right corner and the center
+    loss = np.array([[-1, -1, 0], [1, 0, 0], [0, 1, -1]])
+    mcts.getActionProb(loss, temp=1)
+    assert mcts.Ss[game.stringRepresentation(loss)] == -1
+    assert mcts.lastSearchSims < 400
+
+    # the proven lost child is evicted first (it is never visited), the winning move is still known
+    game, mcts = make_mcts(mctsSolver=True, maxTreeNodes=5, evictionPolicy='visits')
+    assert mcts.getActionProb(win, temp=0)[2] == 1
+
+
+def test_progressive_widening_limits_children():
+    game, mcts = make_mcts(numMCTSSims=16, progressiveWidening=True, pwConstant=1.0, pwExponent=0.5)
+    board = game.getInitBoard()
+    mcts.getActionProb(board, temp=1)
+    s = game.stringRepresentation(board)
+    # 15 visits of the root: at most ceil(sqrt(15)) = 4 children were eligible
+    assert np.count_nonzero(mcts.Nsa[s]) <= 4
+    assert np.all(np.diff(mcts.Ps[s]) <= 0)
+
+
+def test_gumbel_search_improves_policy_within_budget():
+    game, mcts = make_mcts(numMCTSSims=8, gumbel=True, gumbelK=4)
+    board = np.array([[1, 1, 0], [-1, -1, 0], [0, 0, 0]])
+    probs = mcts.getActionProb(board, temp=1)
+    valids = game.getValidMoves(board, 1)
+    assert mcts.lastSearchSims == 8
+    assert abs(sum(probs) - 1) < 1e-6
+    assert all(p == 0 for p, v in zip(probs, valids) if not v)
+
+    # the winning move survives the halving once it has been visited
+    _, mcts = make_mcts(numMCTSSims=16, gumbel=True, gumbelK=6)
+    probs = mcts.getActionProb(board, temp=0)
+    assert probs[2] == 1
+
+    # with fewer simulations than gumbelK, every considered action is visited
+    game = GobangGame(6)
+    mcts = MCTS(game, HashedNNet(game), dotdict({'numMCTSSims': 5, 'cpuct': 1.0, 'gumbel': True}))
+    start = game.getInitBoard()
+    mcts.search(start)
+    probs = mcts.getActionProb(start, temp=1)
+    s = mcts.boardKey(start)
+    assert np.sum(mcts.Nsa[s] > 0) == 5 and mcts.Nsa[s][mcts.As[s] == mcts.lastBestAction] == 1
+
+    # the halving winner is reported in the orientation of the board searched
+    _, mcts = make_mcts(numMCTSSims=16, gumbel=True, symmetricTree=True)
+    probs = mcts.getActionProb(np.rot90(board), temp=0)
+    assert mcts.lastBestAction == int(np.argmax(probs))
+
+    # sigma grows with the visits, the softmax must not overflow
+    _, mcts = make_mcts(numMCTSSims=3000, gumbel=True)
+    with np.errstate(over='raise', invalid='raise'):
+        probs = mcts.getActionProb(board, temp=1)
+    assert np.all(np.isfinite(probs)) and np.isclose(np.sum(probs), 1)
+
+
+def test_playout_cap_randomization_records_full_searches_only():
+    from Coach import Coach
+    game = TicTacToeGame()
+    args = dotdict({'numMCTSSims': 30, 'cpuct': 1.0, 'tempThreshold': 15, 'numMCTSSimsFast': 3,
+                    'playoutCapFraction': 0.0})
+    coach = Coach(game, HashedNNet(game), args)
+    assert coach.executeEpisode() == []
+    assert coach.mcts.lastSearchSims <= 3
+
+    args.playoutCapFraction = 1.0
+    coach = Coach(game, HashedNNet(game), args)
+    examples = coach.executeEpisode()
+    assert len(examples) > 0 and len(examples) % 8 == 0
+
+
+def test_lockstep_self_play_batches_across_games():
+    from SelfPlay import Episode, LockstepSelfPlay
+    game = TicTacToeGame()
+    nnet = HashedNNet(game)
+    batchSizes = []
+    predict_batch = nnet.predict_batch
+    nnet.predict_batch = lambda boards: batchSizes.append(len(boards)) or predict_batch(boards)
+    args = dotdict({'numMCTSSims': 20, 'cpuct': 1.0, 'tempThreshold': 15, 'lockstepGames': 4})
+    games = list(LockstepSelfPlay(game, nnet, args).playGames(6))
+    assert len(games) == 6
+    assert max(batchSizes) > 1
+    for examples in games:
+        assert len(examples) % 8 == 0
+        for board, pi, v in examples:
+            assert board.shape == (3, 3) and abs(sum(pi) - 1) < 1e-6 and v in (-1, 1, 1e-4, -1e-4)
+
+    # greedy moves stop once decided, as in executeEpisode
+    args.update({'tempThreshold': 0, 'earlyStop': True, 'numMCTSSims': 200})
+    selfPlay = LockstepSelfPlay(game, HashedNNet(game), args)
+    episode = Episode(game, HashedNNet(game), args)
+    selfPlay.startMove(episode)
+    while episode.simsLeft > 0:
+        selfPlay.searchRound([episode])
+    assert episode.mcts.simsSaved > 0
+
+    for unsupported in ({'searchTimeMs': 50, 'numMCTSSims': None}, {'rootDirichletAlpha': 0.3}):
+        with pytest.raises(ValueError):
+            LockstepSelfPlay(game, nnet, dotdict(args, **unsupported))
+
+
+def test_async_mcts_shares_batched_evaluations():
+    import asyncio
+    from AsyncMCTS import AsyncMCTS, BatchEvaluator
+    from SelfPlay import AsyncSelfPlay
+    game = TicTacToeGame()
+    args = dotdict({'numMCTSSims': 50, 'cpuct': 1.0, 'leafBatchSize': 4})
+    evaluator = BatchEvaluator(HashedNNet(game), maxBatchSize=16)
+    board = game.getInitBoard()
+
+    async def searchAll():
+        mctss = [AsyncMCTS(game, evaluator, args) for _ in range(4)]
+        return mctss, await asyncio.gather(*[m.getActionProb(board, temp=1) for m in mctss])
+
+    mctss, results = asyncio.run(searchAll())
+    s = game.stringRepresentation(board)
+    for mcts, probs in zip(mctss, results):
+        assert abs(sum(probs) - 1) < 1e-6 and mcts.lastSearchSims == 50
+        for t in mcts.Ns:
+            assert mcts.Nsa[t].sum() == mcts.Ns[t]
+    assert mctss[0].Ns[s] == 49
+    assert evaluator.meanBatchSize() > 4
+
+    args.tempThreshold = 15
+    games = AsyncSelfPlay(game, HashedNNet(game), args).playGames(3)
+    assert len(games) == 3 and all(len(examples) % 8 == 0 for examples in games)
+
+
+def test_coach_learns_from_async_self_play(tmp_path):
+    from Coach import Coach
+    game = TicTacToeGame()
+    args = dotdict({'numMCTSSims': 5, 'cpuct': 1.0, 'tempThreshold': 15, 'checkpoint': str(tmp_path),
+                    'numIters': 1, 'numEps': 3, 'maxlenOfQueue': 1000, 'numItersForTrainExamplesHistory': 2,
+                    'arenaCompare': 2, 'updateThreshold': 0.6, 'asyncSelfPlay': True, 'lockstepGames': 2})
+    coach = Coach(game, TrainingNNet(game), args)
+    coach.learn()
+    assert len(coach.trainExamplesHistory) == 1 and len(coach.trainExamplesHistory[0]) > 0
+
+
+def test_threaded_mcts_keeps_tree_consistent():
+    from ParallelMCTS import ThreadedMCTS
+    game = TicTacToeGame()
+    mcts = ThreadedMCTS(game, HashedNNet(game), dotdict({'numMCTSSims': 200, 'cpuct': 1.0, 'numThreads': 4}))
+    board = game.getInitBoard()
+    probs = mcts.getActionProb(board, temp=1)
+    assert abs(sum(probs) - 1) < 1e-6 and mcts.lastSearchSims == 200
+    s = game.stringRepresentation(board)
+    assert mcts.Ns[s] == 199
+    for t in mcts.Ns:
+        assert mcts.Nsa[t].sum() == mcts.Ns[t]
+        assert np.all(np.abs(mcts.Qsa[t]) <= 1 + 1e-9)
+
+
+def test_root_parallel_mcts_sums_worker_counts():
+    from ParallelMCTS import RootParallelMCTS
+    game = TicTacToeGame()
+    args = dotdict({'numMCTSSims': 30, 'cpuct': 1.0, 'numProcesses': 2, 'rootDirichletAlpha': 0.3})
+    mcts = RootParallelMCTS(game, HashedNNet(game), args)
+    try:
+        board = game.getInitBoard()
+        probs = mcts.getActionProb(board, temp=1)
+        assert abs(sum(probs) - 1) < 1e-6 and mcts.lastSearchSims == 2 * 30
+        arena = Arena(MCTSPlayer(mcts), RandomPlayer(game).play, game)
+        arena.playGames(2)
+    finally:
+        mcts.close()
+
+    # a win proven by one worker is played whatever the visits of the others
+    mcts = RootParallelMCTS(game, HashedNNet(game), dotdict(args, mctsSolver=True))
+    try:
+        win = np.array([[1, 1, 0], [-1, -1, 0], [0, 0, 0]])
+        assert mcts.getActionProb(win, temp=1)[2] == 1
+    finally:
+        mcts.close()
+
+    # the root noise is gone once the search is over
+    game, mcts = make_mcts(rootDirichletAlpha=0.3)
+    _, plain = make_mcts(numMCTSSims=2)
+    board = game.getInitBoard()
+    mcts.getActionProb(board)
+    plain.getActionProb(board)
+    assert np.array_equal(mcts.Ps[game.stringRepresentation(board)], plain.Ps[game.stringRepresentation(board)])
+
+
+def test_search_stats_are_collected_and_merged():
+    game, mcts = make_mcts(collectStats=True)
+    player = MCTSPlayer(mcts)
+    Arena(player, RandomPlayer(game).play, game).playGames(2)
+    stats = player.stats
+    assert stats.numSearches > 0 and stats.numSims >= 49 * stats.numSearches
+    assert stats.nodesCreated == mcts.numExpanded
+    assert 0 < stats.meanDepth() <= stats.maxDepth <= 9
+    assert stats.terminalHits > 0
+    assert 0 < stats.predictTime + stats.gameTime < stats.totalTime
+    merged = SearchStats().merge(stats).merge(stats)
+    assert merged.numSims == 2 * stats.numSims and merged.maxDepth == stats.maxDepth
+
+
+class CheckpointedNNet(HashedNNet):
+    """A HashedNNet whose 'weights' are a salt saved to and loaded from checkpoint files."""
+
+    def __init__(self, game):
+        super().__init__(game)
+        self.salt = 0
+
+    def predict(self, board):
+        pi, v = super().predict(board)
+        return pi, self.salt
+
+    def save_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, filename), 'w') as f:
+            f.write(str(self.salt))
+
+    def load_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
+        with open(os.path.join(folder, filename)) as f:
+            self.salt = float(f.read())
+
+
+def workerSalt(_):
+    import SelfPlay
+    if SelfPlay.worker.remote:
+        return SelfPlay.worker.nnet.predict(np.zeros((3, 3)))[1]
+    return SelfPlay.worker.nnet.salt if SelfPlay.worker.loaded else None
+
+
+def test_self_play_workers_use_published_weights(tmp_path):
+    from SelfPlay import SelfPlayWorkers
+    game = TicTacToeGame()
+    for inferenceServer in (False, True):
+        args = dotdict({'numMCTSSims': 10, 'cpuct': 1.0, 'tempThreshold': 15, 'checkpoint': str(tmp_path),
+                        'inferenceServer': inferenceServer, 'leafBatchSize': 4})
+        nnet = CheckpointedNNet(game)
+        workers = SelfPlayWorkers(game, CheckpointedNNet, args, processes=2)
+        try:
+            for salt in (0.5, -0.5):
+                nnet.salt = salt
+                workers.publish(nnet)
+                for examples, stats in workers.playGames(4):
+                    assert len(examples) > 0
+                assert set(workers.pool.map(workerSalt, range(4))) - {None} == {salt}
+            assert workers.version.value == 2
+        finally:
+            workers.close()
+
+
+class TrainingNNet(CheckpointedNNet):
+    """
+    A CheckpointedNNet whose training moves the salt towards the mean target
+    value, and which replaces the extension of its checkpoint files with
+    .h5 like the keras wrappers do.
+    """
+
+    def train(self, examples):
+        self.salt = float(np.mean(exampleArrays(examples)[2]))
+
+    def save_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
+        super().save_checkpoint(folder, filename.split('.')[0] + '.h5')
+
+    def load_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
+        super().load_checkpoint(folder, filename.split('.')[0] + '.h5')
+
+
+def test_pipelined_learning_promotes_candidates(tmp_path):
+    from Coach import Coach
+    from Pipeline import BEST_FILE, getBestFile
+    game = TicTacToeGame()
+    args = dotdict({'numMCTSSims': 5, 'cpuct': 1.0, 'tempThreshold': 15, 'checkpoint': str(tmp_path),
+                    'numIters': 3, 'numEps': 2, 'maxlenOfQueue': 1000, 'numItersForTrainExamplesHistory': 2,
+                    'arenaCompare': 2, 'updateThreshold': 0.0, 'selfPlayProcesses': 2})
+    coach = Coach(game, TrainingNNet(game), args)
+    coach.learnAsync()
+    assert len(coach.trainExamplesHistory) == 2
+    # candidates waiting together are gated once, the last one always is
+    assert 1 <= len(coach.gateResults) <= 3
+    assert coach.gateResults[-1][0] == coach.getCheckpointFile(3)
+
+    best = TrainingNNet(game)
+    best.load_checkpoint(str(tmp_path), BEST_FILE)
+    numAccepted = sum(accepted for *_, accepted in coach.gateResults)
+    TrainingNNet(game).load_checkpoint(str(tmp_path), getBestFile(1 + numAccepted))
+    if coach.gateResults[-1][-1]:
+        last = TrainingNNet(game)
+        last.load_checkpoint(str(tmp_path), coach.getCheckpointFile(3))
+        assert best.salt == last.salt
+
+
+class BrokenNNet(TrainingNNet):
+    """
+    A TrainingNNet whose checkpoints cannot be loaded.
+    """
+
+    def load_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
+        raise IOError(f'cannot load {filename}')
+
+
+def test_pipelined_learning_fails_with_self_play(tmp_path):
+    from Coach import Coach
+    game = TicTacToeGame()
+    args = dotdict({'numMCTSSims': 5, 'cpuct': 1.0, 'tempThreshold': 15, 'checkpoint': str(tmp_path),
+                    'numIters': 1, 'numEps': 2, 'maxlenOfQueue': 1000, 'numItersForTrainExamplesHistory': 2,
+                    'arenaCompare': 2, 'updateThreshold': 0.0, 'selfPlayProcesses': 2})
+    coach = Coach(game, BrokenNNet(game), args)
+    # the self-play processes die loading the best network, no game ever comes
+    with pytest.raises(RuntimeError, match='self-play process failed'):
+        coach.learnAsync()
+
+
+def test_replay_buffer_ring_and_window():
+    from ReplayBuffer import ReplayBuffer
+
+    def iteration(value, n):
+        return [(np.full((3, 3), value), np.full(9, value / 9.), value) for _ in range(n)]
+
+    buffer = ReplayBuffer((3, 3), 9, capacity=10, window=3)
+    for value, n in (1, 4), (2, 4), (3, 4):
+        buffer.add(iteration(value, n))
+    # the ring overwrote the two oldest examples
+    assert len(buffer) == 10 and list(buffer.iterationSizes) == [2, 4, 4]
+    boards, pis, vs = buffer.arrays()
+    assert list(vs) == [1] * 2 + [2] * 4 + [3] * 4
+    assert np.all(boards[:, 0, 0] == vs) and np.allclose(pis.sum(axis=1), vs)
+    buffer.add(iteration(4, 1))
+    # only the window of 3 iterations is kept
+    assert list(buffer.arrays()[2]) == [2] * 4 + [3] * 4 + [4]
+
+    boards, pis, vs = buffer.sample(64)
+    assert boards.shape == (64, 3, 3) and pis.shape == (64, 9) and set(vs) <= {2, 3, 4}
+    assert np.all(boards[:, 1, 2] == vs)
+
+
+def test_examples_are_saved_as_shards_once(tmp_path):
+    import json
+    from Coach import Coach
+    game = TicTacToeGame()
+    args = dotdict({'numMCTSSims': 5, 'cpuct': 1.0, 'tempThreshold': 15, 'checkpoint': str(tmp_path),
+                    'maxlenOfQueue': 1000, 'numItersForTrainExamplesHistory': 2, 'replayBuffer': True})
+    coach = Coach(game, HashedNNet(game), args)
+    for i in range(3):
+        coach.addIterationExamples([(np.full((3, 3), i), np.full(10, 0.1), i)] * (i + 1))
+        coach.saveTrainExamples(i)
+    shards = sorted(f for f in os.listdir(tmp_path) if f.endswith('.npy'))
+    assert len(shards) == 3 * 3  # every iteration written once
+    with open(os.path.join(tmp_path, coach.getCheckpointFile(2) + '.examples.json')) as f:
+        manifest = json.load(f)
+    # only the window of 2 iterations is referenced
+    assert [shard['size'] for shard in manifest['shards']] == [2, 3]
+
+    args.load_folder_file = (str(tmp_path), coach.getCheckpointFile(2))
+    loaded = Coach(game, HashedNNet(game), args)
+    loaded.loadTrainExamples()
+    assert loaded.skipFirstSelfPlay
+    assert np.array_equal(loaded.replayBuffer.arrays()[2], [1, 1, 2, 2, 2])
+    assert np.array_equal(loaded.replayBuffer.arrays()[0], coach.replayBuffer.arrays()[0])
@@ -2,6 +2,7 @@ from __future__ import print_function
 import sys
 sys.path.append('..')
 from Game import Game
+from utils import ZobristHash
 from .TicTacToeLogic import Board
 import numpy as np
 
@@ -17,6 +18,7 @@ Based on the OthelloGame by Surag Nair.
 class TicTacToeGame(Game):
     def __init__(self, n=3):
         self.n = n
+        self.zobrist = ZobristHash((n, n))
 
     def getInitBoard(self):
         # return initial board (numpy board)
@@ -94,6 +96,9 @@ class TicTacToeGame(Game):
         # 8x8 numpy array (canonical board)
         return board.tostring()
 
+    def hashKey(self, board):
+        return self.zobrist.hash(board)
+
     @staticmethod
     def display(board):
         n = board.shape[0]
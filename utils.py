@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class AverageMeter(object):
     """From https://github.com/pytorch/examples/blob/master/imagenet/main.py"""
 
@@ -20,3 +23,37 @@ class AverageMeter(object):
 class dotdict(dict):
     def __getattr__(self, name):
         return self[name]
+
+
+def exampleArrays(examples):
+    """
+    Returns the boards, pis and vs of examples, a list of (board, pi, v) or a
+    ReplayBuffer, as three arrays.
+    """
+    if hasattr(examples, 'arrays'):
+        return examples.arrays()
+    boards, pis, vs = list(zip(*examples))
+    return np.asarray(boards), np.asarray(pis), np.asarray(vs)
+
+
+class ZobristHash(object):
+    """
+    64-bit Zobrist hashing of boards whose cells hold small integers (e.g. -1,
+    0 and 1 for the two players and empty squares). Every (cell, value) pair
+    gets a random 64-bit key and the hash of a board is the XOR of the keys of
+    its cells.
+    """
+
+    def __init__(self, shape, values=(-1, 0, 1), seed=0):
+        rng = np.random.RandomState(seed)
+        numCells = int(np.prod(shape))
+        numValues = max(values) - min(values) + 1
+        self.keys = rng.randint(0, 2 ** 64, size=numCells * numValues, dtype=np.uint64)
+        # index of the key of value 0 for every cell, in row-major cell order
+        self.offsets = np.arange(numCells) * numValues - min(values)
+
+    def hash(self, board):
+        values = np.asarray(board).ravel()
+        if values.dtype.kind != 'i':
+            values = values.astype(np.intp)
+        return int(np.bitwise_xor.reduce(self.keys[self.offsets + values]))